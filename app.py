@@ -1,7 +1,9 @@
 from flask import Flask, render_template, request, redirect
-import os, csv, ast
+import os
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+from catalog import ProductCatalog
+
 
 def create_app(config=None):
     app = Flask(__name__, static_folder='static', template_folder='templates')
@@ -22,16 +24,15 @@ def create_app(config=None):
     # SEARCH DATABASE FOR PRODUCT (RETURN CORDS)
     # -----------------------------------------------------
     
-    def search_product_by_name(product_name, csv_file="database/products.csv"):
-        with open(csv_file, newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row["Name"].lower() == product_name.lower():
-                    Xcoord = ast.literal_eval(row["X"])
-                    Ycord = ast.literal_eval(row["Y"])
-                    Zcord = ast.literal_eval(row["Z"])
-                    return Xcoord, Ycord, Zcord
-        return None
+    catalog = ProductCatalog(app.config['CSV_FILE'])
+    app.extensions['catalog'] = catalog
+
+    def search_product_by_name(product_name):
+        product = catalog.find_by_name(product_name)
+        if product is None:
+            return None
+        # Plain (X, Y, Z) tuples, as the page has always displayed them
+        return tuple(tuple(point) for point in product.coords)
 
     # -----------------------------------------------------
     # ROUTES
@@ -54,7 +55,7 @@ def create_app(config=None):
             product_name = request.form.get("product")
 
             # Look up coords from CSV via helpers.py
-            coords = search_product_by_name(product_name, app.config['CSV_FILE'])
+            coords = search_product_by_name(product_name)
 
             if coords:
                 result = f"Product found! Please follow Pepper Robot. (Coordinates: {coords})"
@@ -1,26 +1,27 @@
 
-import requests
-from flask import Flask, Response, render_template, request, redirect, render_template_string, url_for
+import click
+import json
+from flask import Flask, Response, jsonify, render_template, request, redirect, render_template_string, stream_with_context, url_for
 import os
-import csv
-import ast
 import time
-import threading
 
-# --- BARCODE DECODING IMPORTS ---
-from PIL import Image
-from pyzbar.pyzbar import decode, ZBarSymbol
+from catalog import ALLERGENS, ProductCatalog, split_allergens
+from catalog_binary import build_catalog
+from catalog_sqlite import import_catalog
+from lookup_cache import LookupCache
 
-# --- Global State for Continuous Scanning (Shared) ---
-lock = threading.Lock()
-scanning = False
-last_decoded_data = None
-scan_thread = None
+# --- BARCODE DECODING IMPORTS ---
+from decoding import FrameDecoder, make_decode_pool, symbologies_for
+from frames import MJPEG_MIMETYPE, STREAM_HEADERS, FrameBuffer
+from motion import MotionScheduler
+from scanner import CameraFeed, ScanJobRegistry
+from scanner_service import load_config as load_scanner_config
 
 # --- Configuration for Scanner ---
 # !! UPDATE THIS IP TO MATCH YOUR ESP32-CAM !!
 ESP32_CAM_IP = "192.168.1.132"
 IMAGE_URL = f"http://{ESP32_CAM_IP}/"
+# Set SCANNER_PERSIST_FILE to this (or any path) to also keep the newest frame on disk
 OUTPUT_FILENAME = "last_captured_barcode.jpg"
 
 
@@ -32,139 +33,223 @@ def create_app(config=None):
     # -----------------------------------------------------
     app.config.from_mapping(
         SECRET_KEY=os.environ.get('SECRET_KEY', 'dev-key'),
-        CSV_FILE=os.path.join(app.root_path, 'database/products.csv')
+        CSV_FILE=os.path.join(app.root_path, 'database/products.csv'),
+        CATALOG_FILE=os.environ.get('CATALOG_FILE'),
+        LOOKUP_CACHE_SIZE=1024,
+        LOOKUP_CACHE_TTL=300.0,
+        LOOKUP_CACHE_NEGATIVE_TTL=30.0,
+        SCANNER_PERSIST_FILE=None,
+        SCANNER_CONFIG=os.environ.get('SCANNER_CONFIG'),
+        SCAN_DELAY_SECONDS=0.5,
+        # Capture speeds up to SCAN_MIN_DELAY_SECONDS on motion and idles down to SCAN_MAX_DELAY_SECONDS
+        SCAN_ADAPTIVE=True,
+        SCAN_MIN_DELAY_SECONDS=0.1,
+        SCAN_MAX_DELAY_SECONDS=2.0,
+        # Decode preprocessing; SCANNER_ROI is (left, top, right, bottom) as fractions of the frame
+        SCANNER_GRAYSCALE=True,
+        SCANNER_DOWNSCALE_WIDTH=400,
+        SCANNER_ROI=None,
+        # Frames within this many hash bits of the last empty frame are not decoded (None: decode all)
+        SCANNER_DEDUP_DISTANCE=1,
+        # "thread" decodes on each camera's decode thread; "process" in a shared pool of
+        # SCANNER_DECODE_WORKERS processes (default: one per core) holding at most
+        # SCANNER_DECODE_MAX_PENDING frames (default: two per worker)
+        SCANNER_DECODE_BACKEND='thread',
+        SCANNER_DECODE_WORKERS=None,
+        SCANNER_DECODE_MAX_PENDING=None,
+        # A scan job ends after SCAN_JOB_TIMEOUT seconds without a barcode, or after
+        # SCAN_JOB_IDLE_SECONDS with no page or client following it
+        SCAN_JOB_TIMEOUT=60.0,
+        SCAN_JOB_IDLE_SECONDS=20.0
     )
 
     if config:
         app.config.update(config)
 
+    # -----------------------------------------------------
+    # PRODUCT CATALOG (loaded once, reloaded when the CSV changes)
+    # -----------------------------------------------------
+    # CATALOG_FILE may point at a compiled .bin catalog (see `flask build-catalog`)
+    # or a SQLite catalog (see `flask import-catalog`)
+    catalog = ProductCatalog(app.config.get('CATALOG_FILE') or app.config['CSV_FILE'])
+    app.extensions['catalog'] = catalog
+
+    @app.cli.command('build-catalog')
+    @click.argument('source', required=False)
+    @click.argument('output', required=False)
+    def build_catalog_command(source, output):
+        """Compiles products.csv/products.xlsx into an mmap-able binary catalog."""
+        source = source or app.config['CSV_FILE']
+        output = output or os.path.join(app.root_path, 'database/products.bin')
+        written, skipped = build_catalog(source, output)
+        click.echo(f"--- Wrote {written} products to {output} ({skipped} rejected) ---")
+
+    @app.cli.command('import-catalog')
+    @click.argument('source', required=False)
+    @click.argument('output', required=False)
+    def import_catalog_command(source, output):
+        """Imports products.csv/products.xlsx into a SQLite catalog in a single transaction."""
+        source = source or app.config['CSV_FILE']
+        output = output or os.path.join(app.root_path, 'database/products.db')
+        written, skipped = import_catalog(source, output)
+        click.echo(f"--- Imported {written} products into {output} ({skipped} rejected) ---")
+
     # -----------------------------------------------------
     # HELPER FUNCTIONS: SEARCH AND ALLERGY CHECK (UPDATED)
     # -----------------------------------------------------
 
-    def search_product_by_name(product_name, csv_file):
-        """Searches CSV for a product name and returns its location coords and allergen list."""
-        try:
-            with open(csv_file, newline='', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    if row.get("Name", "").lower() == product_name.lower():
-                        # Safely convert coordinate strings to Python objects (tuples)
-                        coords = (ast.literal_eval(row["X"]), ast.literal_eval(row["Y"]), ast.literal_eval(row["Z"]))
-                        allergens_raw = row.get("Allergens", "None")
-                        product_name_found = row["Name"]
-                        return coords, allergens_raw, product_name_found
-            return None, None, None
-        except FileNotFoundError:
-            print(f"ERROR: CSV file not found at {csv_file}")
+    def search_product_by_name(product_name):
+        """Looks up a product name in the catalog and returns its location coords and allergen mask."""
+        product = catalog.find_by_name(product_name)
+        if product is None:
             return None, None, None
-        except Exception as e:
-            print(f"ERROR during name search: {e}")
+        return product.coords, product.allergen_mask, product.name
+
+    def search_product_by_barcode(barcode_data):
+        """Looks up a barcode string in the catalog and returns its location coords and allergen mask."""
+        product = catalog.find_by_barcode(barcode_data)
+        if product is None:
             return None, None, None
+        return product.coords, product.allergen_mask, product.name
+
+    # Search score (0-1) at which a name that did not match exactly is shown without asking.
+    # Typos and partial names score well below it, so they only become "Did you mean" buttons.
+    AUTO_SELECT_SCORE = 0.8
+
+    def suggest_products(product_name, limit=5):
+        """Typo-tolerant search over the catalog names. Returns (name, score) pairs, best first."""
+        return [(product.name, score) for product, score in catalog.search(product_name, limit)]
+
+    def safe_alternatives(product_name, user_mask, limit=3):
+        """Names of similar products that are safe for the user's allergies."""
+        product = catalog.find_by_name(product_name)
+        if product is None:
+            return []
+        return [alternative.name for alternative in catalog.safe_alternatives(product, user_mask, limit)]
+
+    def read_allergies(values):
+        """Collects the user's allergies from repeated or comma-separated 'allergy' fields."""
+        # Pick up catalog changes first, so allergens new to the catalog have bits in the mask
+        catalog.refresh()
+        allergies = split_allergens(",".join(values.getlist("allergy")))
+        # Canonical form passed along in links and redirects
+        allergy_param = ",".join(allergies) or "None"
+        return allergies, allergy_param, ALLERGENS.mask(allergies)
+
+    def check_safety(user_mask, product_mask):
+        """Compares the user's allergies to the product's allergens: a single AND of their bitmasks."""
+        clash = user_mask & product_mask
+
+        # Check if any of the user's allergies is in the product's allergen list
+        if clash:
+            return False, f"🛑 UNSAFE: Contains **{', '.join(ALLERGENS.names(clash))}**."
+
+        # Safe to track (always the case when no allergy is selected)
+        return True, "Product found! Please follow Pepper Robot."
 
-    def search_product_by_barcode(barcode_data, csv_file):
-        """Searches CSV for a barcode string and returns its location coords and allergen list."""
-        try:
-            with open(csv_file, newline='', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    if row.get("Barcode") == barcode_data:
-                        coords = (ast.literal_eval(row["X"]), ast.literal_eval(row["Y"]), ast.literal_eval(row["Z"]))
-                        allergens_raw = row.get("Allergens", "None")
-                        product_name_found = row["Name"]
-                        return coords, allergens_raw, product_name_found
+    # -----------------------------------------------------
+    # LOOKUP CACHE (search + safety check, per allergy set)
+    # -----------------------------------------------------
+    lookup_cache = LookupCache(
+        catalog.current_version,
+        maxsize=app.config['LOOKUP_CACHE_SIZE'],
+        ttl=app.config['LOOKUP_CACHE_TTL'],
+        negative_ttl=app.config['LOOKUP_CACHE_NEGATIVE_TTL'],
+    )
+    app.extensions['lookup_cache'] = lookup_cache
 
-            return None, None, None
-        except FileNotFoundError:
-            print(f"ERROR: CSV file not found at {csv_file}")
-            return None, None, None
-        except Exception as e:
-            print(f"ERROR during barcode search: {e}")
-            return None, None, None
+    def lookup_product(kind, query, user_mask):
+        """Cached search ("name" or "barcode") plus safety check.
 
-    def check_safety(user_allergy, product_allergens):
-        """Compares the user's allergy to the product's allergens."""
-        # If user has no allergy selected, it's always safe to track.
-        if user_allergy == "None":
-            return True, "Product found! Please follow Pepper Robot."
+        Returns (coords, allergens, name, is_safe, safety_message), all None if not found.
+        """
+        query = (query or "").strip()
+        search = search_product_by_barcode if kind == "barcode" else search_product_by_name
+        key = (kind, query.lower() if kind == "name" else query, user_mask)
 
-        # Split and clean the product's allergen list for comparison
-        product_allergen_list = [a.strip().lower() for a in product_allergens.split(',')]
-        user_allergy_lower = user_allergy.lower()
+        def compute():
+            coords_tuple, allergens, name_found = search(query)
+            if coords_tuple is None:
+                return None
+            return (coords_tuple, allergens, name_found) + check_safety(user_mask, allergens)
 
-        # Check if the user's allergy is in the product's allergen list
-        if user_allergy_lower in product_allergen_list:
-            return False, f"🛑 UNSAFE: Contains **{user_allergy}**."
+        return lookup_cache.get(key, compute) or (None, None, None, None, None)
 
-        # Safe to track
-        return True, "Product found! Please follow Pepper Robot."
+    # Lookup helpers, for tooling that calls them without going through HTTP (e.g. benchmarks)
+    app.extensions['product_lookup'] = {
+        'search_product_by_name': search_product_by_name,
+        'search_product_by_barcode': search_product_by_barcode,
+        'check_safety': check_safety,
+        'lookup_product': lookup_product,
+    }
 
     # -----------------------------------------------------
     # HELPER FUNCTIONS: BARCODE SCANNING THREAD LOGIC
     # -----------------------------------------------------
 
-    def decode_saved_image(image_path):
-        """Decodes barcodes and QR codes from the locally saved image file."""
-        global last_decoded_data
-
-        if not os.path.exists(image_path):
-            return False
-
-        try:
-            img = Image.open(image_path)
-            decoded_objects = decode(img, symbols=[ZBarSymbol.QRCODE, ZBarSymbol.EAN13, ZBarSymbol.CODE128])
-
-            if decoded_objects:
-                data = decoded_objects[0].data.decode('utf-8')
-                code_type = decoded_objects[0].type
-                print(f"--- DECODED {code_type}: {data} ---")
-
-                with lock:
-                    global scanning
-                    scanning = False  # Stop the loop after a successful read
-                    last_decoded_data = data
-                return True
-
-            return False
-
-        except Exception as e:
-            print(f"FATAL DECODE ERROR: {e}")
-            return False
-
-    def continuous_scan_loop():
-        """Runs in a separate thread. Captures, saves, and decodes images until 'scanning' is False."""
-        global scanning
-        print("\n--- Starting Continuous Barcode Scanning Thread ---")
-        SCAN_DELAY_SECONDS = 0.5
-
-        while True:
-            with lock:
-                if not scanning:
-                    print("--- Scanning thread received stop signal. Exiting. ---")
-                    break
-
-            # 1. Fetch Image from ESP32-CAM
-            try:
-                response = requests.get(IMAGE_URL, timeout=5)
-                response.raise_for_status()
-                image_bytes = response.content
-            except requests.exceptions.RequestException as e:
-                print(f"ERROR: Could not fetch image from ESP32: {e}")
-                time.sleep(SCAN_DELAY_SECONDS * 2)
-                continue
-
-            # 2. Save Image Locally
-            try:
-                with open(OUTPUT_FILENAME, 'wb') as f:
-                    f.write(image_bytes)
-            except Exception as e:
-                print(f"ERROR: Could not save file {OUTPUT_FILENAME}: {e}")
-
-            # 3. ATTEMPT BARCODE DECODING
-            decode_saved_image(OUTPUT_FILENAME)
-
-            # 4. Wait for the next scan attempt
-            time.sleep(SCAN_DELAY_SECONDS)
+    # Cameras come from SCANNER_CONFIG (the scanner service's JSON file) or default to ESP32_CAM_IP.
+    # Its decode and capture settings apply too: a camera's own value, else the file's
+    # top-level one, else the app config.
+    if app.config['SCANNER_CONFIG']:
+        scanner_config = load_scanner_config(app.config['SCANNER_CONFIG'])
+        camera_configs = scanner_config['cameras']
+    else:
+        scanner_config = {}
+        camera_configs = [{"name": "default", "url": IMAGE_URL}]
+
+    def camera_setting(cam, key, config_key):
+        return cam.get(key, scanner_config.get(key, app.config[config_key]))
+
+    decode_pool = make_decode_pool(scanner_config.get("decode_backend", app.config['SCANNER_DECODE_BACKEND']),
+                                   scanner_config.get("decode_workers", app.config['SCANNER_DECODE_WORKERS']),
+                                   scanner_config.get("decode_max_pending", app.config['SCANNER_DECODE_MAX_PENDING']))
+    feeds = []
+    for i, cam in enumerate(camera_configs):
+        decoder_config = dict(scanner_config.get("decoder", {}))
+        decoder_config.update(cam.get("decoder", {}))
+        if "roi" in cam:
+            decoder_config["roi"] = cam["roi"]
+        # Grayscale, downscale-first decoding with a full-resolution retry around likely barcodes
+        decoder = FrameDecoder(grayscale=decoder_config.get("grayscale", app.config['SCANNER_GRAYSCALE']),
+                               downscale_width=decoder_config.get("downscale_width",
+                                                                  app.config['SCANNER_DOWNSCALE_WIDTH']),
+                               roi=decoder_config.get("roi", app.config['SCANNER_ROI']),
+                               dedup_distance=decoder_config.get("dedup_distance",
+                                                                 app.config['SCANNER_DEDUP_DISTANCE']),
+                               pool=decode_pool)
+        # Recent frames live in memory; writing the newest to disk is optional and off the scan path
+        frame_buffer = FrameBuffer(persist_path=app.config['SCANNER_PERSIST_FILE'] if i == 0 else None)
+        capture_delay = camera_setting(cam, "scan_delay_seconds", 'SCAN_DELAY_SECONDS')
+        scheduler = None
+        if camera_setting(cam, "adaptive", 'SCAN_ADAPTIVE'):
+            scheduler = MotionScheduler(capture_delay,
+                                        min_delay=camera_setting(cam, "min_delay_seconds", 'SCAN_MIN_DELAY_SECONDS'),
+                                        max_delay=camera_setting(cam, "max_delay_seconds", 'SCAN_MAX_DELAY_SECONDS'))
+        feeds.append(CameraFeed(cam["name"], cam["url"], decoder, frame_buffer,
+                                capture_delay=capture_delay, scheduler=scheduler))
+
+    # Scan jobs, one per customer scan; jobs on the same camera share its capture loop
+    scan_jobs = ScanJobRegistry(feeds, job_timeout=app.config['SCAN_JOB_TIMEOUT'],
+                                idle_timeout=app.config['SCAN_JOB_IDLE_SECONDS'])
+    app.extensions['scan_jobs'] = scan_jobs
+    @app.context_processor
+    def scan_camera_names():
+        # Lets the product page offer a camera choice when there is more than one
+        return {'scan_cameras': list(scan_jobs.feeds)}
+
+    # Catalog version the decoders' symbologies were derived from
+    decoder_catalog_version = None
+
+    def update_decoder_symbols():
+        """Scans only for the symbologies the catalog's barcodes can be printed in."""
+        nonlocal decoder_catalog_version
+        version = catalog.current_version()
+        if version != decoder_catalog_version:
+            symbols = symbologies_for(catalog.barcodes())
+            for feed in feeds:
+                feed.decoder.set_symbols(symbols)
+            decoder_catalog_version = version
+            print(f"--- Scanning for {', '.join(symbol.name for symbol in symbols)} ---")
 
     # -----------------------------------------------------
     # FLASK ROUTES
@@ -179,26 +264,39 @@ def create_app(config=None):
         """Handles user entry, manual search, and result display with allergy check (UPDATED)."""
 
         user_name = request.values.get("name", "there")
-        allergy = request.values.get("allergy", "")
+        _allergies, allergy, user_mask = read_allergies(request.values)
 
         result = request.args.get("result", None)
         coords = None  # Coordinates are no longer displayed on the page
+        suggestions = []
+        alternatives = []
 
         if request.method == 'POST':
             product_name = request.form.get("product")
 
-            # Search returns (coords, allergens)
-            coords_tuple, allergens = search_product_by_name(product_name, app.config['CSV_FILE'])
+            # Lookup returns (coords, allergens, name, is_safe, safety_message)
+            coords_tuple, _, name_found, is_safe, safety_message = lookup_product("name", product_name, user_mask)
+            prefix = ""
+
+            if not coords_tuple:
+                # No exact match: only a near-certain match is shown straight away, so the
+                # robot never leads a customer to a product they did not ask for
+                matches = suggest_products(product_name)
+                if matches and matches[0][1] >= AUTO_SELECT_SCORE:
+                    coords_tuple, _, name_found, is_safe, safety_message = lookup_product(
+                        "name", matches.pop(0)[0], user_mask
+                    )
+                    prefix = f"Showing results for '{name_found}'. "
+                suggestions = [name for name, _score in matches]
 
             if coords_tuple:
-                is_safe, safety_message = check_safety(allergy, allergens)
-
                 if is_safe:
                     # Safe product found. Display success message
-                    result = f"✅ {safety_message}"
+                    result = f"✅ {prefix}{safety_message}"
                 else:
-                    # Dangerous product found. Display warning and stop
-                    result = f"{safety_message} DO NOT CONSUME."
+                    # Dangerous product found. Display warning, stop and offer safe alternatives
+                    result = f"{prefix}{safety_message} DO NOT CONSUME."
+                    alternatives = safe_alternatives(name_found, user_mask)
             else:
                 result = f"Sorry, '{product_name}' was not found in the database."
 
@@ -207,7 +305,9 @@ def create_app(config=None):
             name=user_name,
             allergy=allergy,
             result=result,
-            coords=coords
+            coords=coords,
+            suggestions=suggestions,
+            alternatives=alternatives
         )
 
     # -----------------------------------------------------
@@ -215,76 +315,80 @@ def create_app(config=None):
     # -----------------------------------------------------    
     @app.route('/scan', methods=['POST'])
     def scan_start_trigger():
-        """Starts the scanning thread and redirects to the status page."""
-        global scanning, scan_thread, last_decoded_data
-
+        """Starts a scan job for this customer and redirects to its status page."""
         user_name = request.form.get("name", "there")
-        allergy = request.form.get("allergy", "")
-
-        with lock:
-            last_decoded_data = None
+        _allergies, allergy, _user_mask = read_allergies(request.form)
+        camera = request.form.get("camera") or None
 
-            if scan_thread is None or not scan_thread.is_alive():
-                scanning = True
+        if camera is not None and camera not in scan_jobs.feeds:
+            return Response(f"Unknown camera '{camera}'", status=404)
 
-                new_scan_thread = threading.Thread(target=continuous_scan_loop, daemon=True)
-                new_scan_thread.start()
-                scan_thread = new_scan_thread
-            else:
-                scanning = True
+        update_decoder_symbols()
+        job = scan_jobs.start(camera)
 
-        return redirect(f'/scanner_status?name={user_name}&allergy={allergy}')
+        return redirect(url_for('scanner_status', job=job.id, name=user_name, allergy=allergy))
 
     # -----------------------------------------------------
     # ROUTE: SCANNER STATUS (HTML PRESERVED AS REQUESTED)
     # -----------------------------------------------------    
-    @app.route('/scanner_status', methods=['GET'])
-    def scanner_status():
-        """Page that waits and checks the global state for a decoded barcode."""
-        global last_decoded_data
-
-        with lock:
-            current_barcode = last_decoded_data
+    # What the customer is told when a scan ends without a barcode
+    SCAN_END_MESSAGES = {
+        "expired": "⚠️ No barcode was found in time. Please press Scan again.",
+        "cancelled": "Scan cancelled. Press Scan when you are ready.",
+        # The scan page was closed or lost its connection, so the camera was stopped
+        "abandoned": "⚠️ The scan was stopped because this page stopped responding. Please press Scan again.",
+    }
+
+    def scan_result_url(job, user_name, allergy, user_mask):
+        """Where a finished (or unknown) scan job sends the customer: the product page with a safety message."""
+        if job is None or job.state != "decoded":
+            message = SCAN_END_MESSAGES.get(job.state if job else None,
+                                            "⚠️ That scan has expired. Please press Scan again.")
+            return url_for('product_page', name=user_name, allergy=allergy, result=message)
+        current_barcode = job.result
+
+        # BARCODE FOUND: TRIGGER CSV LOOKUP
+
+        # If product is not found, this returns (None, None, None, None, None)
+        coords_tuple, _, name_found, is_safe, safety_message = lookup_product(
+            "barcode", current_barcode, user_mask
+        )
 
-        user_name = request.args.get("name", "there")
-        allergy = request.args.get("allergy", "")
+        if coords_tuple:
+            # --- PRODUCT FOUND IN DATABASE ---
+            if is_safe:
+                # Safe product found. Use product name in message.
+                result_msg = (
+                    f"✅ **{name_found}** decoded! This product is good to eat. Please follow Pepper Robot."
+                )
+            else:
+                # Dangerous product found. Use product name in message.
+                result_msg = (
+                    f"⚠️ **{name_found}** decoded. {safety_message} **DO NOT EAT.**"
+                )
+        else:
+            # --- PRODUCT NOT FOUND (coords_tuple is None) ---
+            # Must use current_barcode in the warning message, not name_found
+            result_msg = f"⚠️ Barcode **{current_barcode}** decoded, but product not found in database."
 
-        if current_barcode:
-            # BARCODE FOUND: TRIGGER CSV LOOKUP and REDIRECT 
+        return url_for('product_page', name=user_name, allergy=allergy, result=result_msg)
 
-            # If product is not found, this returns (None, None, None)
-            coords_tuple, allergens, name_found = search_product_by_barcode(current_barcode, app.config['CSV_FILE'])
+    @app.route('/scanner_status', methods=['GET'])
+    def scanner_status():
+        """Page that waits for this customer's scan job to decode a barcode.
 
-            if coords_tuple:
-                # --- PRODUCT FOUND IN DATABASE ---
-                is_safe, safety_message = check_safety(allergy, allergens)
+        The page listens on /scan_events for the decode, so it never
+        reloads itself; without JavaScript it falls back to
+        refreshing every 2 seconds.
+        """
+        user_name = request.args.get("name", "there")
+        _allergies, allergy, user_mask = read_allergies(request.args)
 
-                if is_safe:
-                    # Safe product found. Use product name in message.
-                    result_msg = (
-                        f"✅ **{name_found}** decoded! This product is good to eat. Please follow Pepper Robot."
-                    )
-                else:
-                    # Dangerous product found. Use product name in message.
-                    result_msg = (
-                        f"⚠️ **{name_found}** decoded. {safety_message} **DO NOT EAT.**"
-                    )
+        job = scan_jobs.get(request.args.get("job"))
+        if job is None or job.done:
+            # Redirect to product_page with the new safety message
+            return redirect(scan_result_url(job, user_name, allergy, user_mask))
 
-                coords_str = None
-            else:
-                # --- PRODUCT NOT FOUND (coords_tuple is None) ---
-                # Must use current_barcode in the warning message, not name_found
-                result_msg = f"⚠️ Barcode **{current_barcode}** decoded, but product not found in database."
-                coords_str = None
-
-            # Global state reset and redirect MUST happen after the checks
-            with lock:
-                last_decoded_data = None
-
-                    # Redirect to product_page with the new safety message
-            return redirect(
-                url_for('product_page', name=user_name, allergy=allergy, result=result_msg, coords=coords_str)
-            )
         return render_template_string("""
                                <!DOCTYPE html>
                                 <html lang="en">
@@ -293,7 +397,7 @@ def create_app(config=None):
                                     <meta name="viewport" content="width=device-width, initial-scale=1.0">
                                     <title>Scanning...</title>
                                     <link rel="stylesheet" href="{{ url_for('static', filename='css/style.css') }}">
-                                    <meta http-equiv="refresh" content="2">
+                                    <noscript><meta http-equiv="refresh" content="2"></noscript>
                                 </head>
                                 <body
                                 style="
@@ -305,18 +409,93 @@ def create_app(config=None):
                                         <h1 style="color: #197278;">Scanning Barcode...</h1>
 
                                         <p style="margin-bottom: 20px; color: #333;">
-                                            Scanning camera (IP: {}). Please hold the product steady.
+                                            Scanning camera {{ camera }} ({{ camera_url }}). Please hold the product steady.
                                         </p>
 
-                                        <img src="/latest_image" alt="Live Scanner Feed"/>
+                                        <img id="scanner-feed" src="{{ url_for('preview_stream', camera=camera) }}" alt="Live Scanner Feed"/>
 
                                         <p style="font-size: 0.9em; margin-top: 20px; color: #777;">
-                                            This page refreshes automatically.
+                                            This page updates automatically.
                                         </p>
+
+                                        <button id="cancel-scan" type="button" hidden>Cancel scan</button>
                                     </div>
+                                    <script>
+                                        // The decode (or the end of the scan) is pushed by the server the moment it happens
+                                        var events = new EventSource({{ events_url|tojson }});
+                                        events.addEventListener("decoded", function (e) {
+                                            events.close();
+                                            window.location.replace(JSON.parse(e.data).redirect);
+                                        });
+                                        // Cancelling frees the camera; the event stream then sends the redirect
+                                        var cancel = document.getElementById("cancel-scan");
+                                        cancel.hidden = false;
+                                        cancel.addEventListener("click", function () {
+                                            cancel.disabled = true;
+                                            fetch({{ cancel_url|tojson }}, {method: "POST"});
+                                        });
+                                    </script>
                                 </body>
                                 </html>
-                            """.format(ESP32_CAM_IP))
+                            """, camera=job.camera, camera_url=scan_jobs.feeds[job.camera].url,
+                                      events_url=url_for('scan_events', job_id=job.id, name=user_name, allergy=allergy),
+                                      cancel_url=url_for('api_cancel_scan_job', job_id=job.id))
+
+    # -----------------------------------------------------
+    # ROUTE: SCAN EVENTS (Server-Sent Events)
+    # -----------------------------------------------------
+    # How often a stream with ?frames=1 checks for a new frame, the fewest seconds between
+    # "frame" events (each one costs the client an image request), and the keep-alive period
+    SCAN_EVENTS_FRAME_POLL = 0.1
+    SCAN_EVENTS_FRAME_INTERVAL = 1.0
+    SCAN_EVENTS_KEEPALIVE = 15.0
+
+    def sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    @app.route('/scan_events/<job_id>')
+    def scan_events(job_id):
+        """Pushes a scan job's decode to the status page as a Server-Sent Event.
+
+        Sends one "decoded" {"state", "result", "redirect"} when the job
+        ends, with or without a barcode. With ?frames=1 it also sends
+        "frame" {"seq", "image"} for new camera frames, at most one per
+        SCAN_EVENTS_FRAME_INTERVAL. An open stream keeps the job from being
+        abandoned.
+        """
+        send_frames = request.args.get("frames") == "1"
+        user_name = request.args.get("name", "there")
+        _allergies, allergy, user_mask = read_allergies(request.args)
+        job = scan_jobs.get(job_id)
+        feed = scan_jobs.feeds[job.camera] if job else None
+
+        def stream():
+            if job is None or job.done:
+                yield sse("decoded", {"state": job.state if job else None, "result": job.result if job else None,
+                                      "redirect": scan_result_url(job, user_name, allergy, user_mask)})
+                return
+            seq = 0
+            last_sent = time.monotonic()
+            with job.watch():
+                while True:
+                    # Wakes the moment the job ends; otherwise checks for a newer frame or sends a keep-alive
+                    if job.wait(SCAN_EVENTS_FRAME_POLL if send_frames else SCAN_EVENTS_KEEPALIVE):
+                        yield sse("decoded", {"state": job.state, "result": job.result,
+                                              "redirect": scan_result_url(job, user_name, allergy, user_mask)})
+                        return
+                    frame = feed.frames.latest() if send_frames else None
+                    if frame is not None and frame.seq > seq and (
+                            not seq or time.monotonic() - last_sent >= SCAN_EVENTS_FRAME_INTERVAL):
+                        seq = frame.seq
+                        yield sse("frame", {"seq": seq, "image": url_for('latest_image', camera=job.camera, seq=seq)})
+                        last_sent = time.monotonic()
+                    elif time.monotonic() - last_sent >= SCAN_EVENTS_KEEPALIVE:
+                        yield ": keep-alive\n\n"
+                        last_sent = time.monotonic()
+
+        # stream_with_context keeps url_for and the lookup helpers usable while streaming
+        return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                        headers=STREAM_HEADERS)
 
         # -----------------------------------------------------
         # ROUTE: IMAGE SERVICE
@@ -324,15 +503,132 @@ def create_app(config=None):
 
     @app.route('/latest_image')
     def latest_image():
-        """Serves the most recently saved image file from the background scanner."""
-        try:
-            with open(OUTPUT_FILENAME, 'rb') as f:
-                image_bytes = f.read()
-            return Response(image_bytes, mimetype='image/jpeg')
-        except FileNotFoundError:
+        """Serves the newest frame from a camera (default: the first), straight from memory."""
+        feed = scan_jobs.feeds.get(request.args.get("camera") or scan_jobs.default_camera)
+        if feed is None:
+            return Response("Unknown camera", status=404)
+        # A specific frame (as announced by /scan_events) if still buffered, else the newest
+        seq = request.args.get("seq", type=int)
+        frame = (feed.frames.get(seq) if seq else None) or feed.frames.latest()
+        if frame is None:
             return Response("Waiting for camera connection...", status=404)
-        except Exception as e:
-            return Response(f"Error serving image: {e}", status=500)
+
+        # Conditional GET: a client that already has this frame gets a bodiless 304
+        return feed.frames.frame_response(frame, request, immutable=seq == frame.seq)
+
+    # -----------------------------------------------------
+    # ROUTE: MJPEG LIVE PREVIEW
+    # -----------------------------------------------------
+    # A preview ends after this long without a new frame (the camera loop stops when no one is scanning)
+    PREVIEW_IDLE_TIMEOUT = 30.0
+
+    @app.route('/preview.mjpg')
+    def preview_stream():
+        """Live multipart/x-mixed-replace preview of a camera (default: the first).
+
+        Every viewer reads the camera's shared frame buffer, so viewers add no
+        load on the camera; a slow viewer skips to the newest frame instead of
+        falling behind.
+        """
+        feed = scan_jobs.feeds.get(request.args.get("camera") or scan_jobs.default_camera)
+        if feed is None:
+            return Response("Unknown camera", status=404)
+
+        return Response(feed.frames.mjpeg_stream(idle_timeout=PREVIEW_IDLE_TIMEOUT), mimetype=MJPEG_MIMETYPE,
+                        headers=STREAM_HEADERS)
+
+    # -----------------------------------------------------
+    # ROUTE: BATCH LOOKUP API (shelf-audit tooling)
+    # -----------------------------------------------------
+    MAX_LOOKUP_ITEMS = 10000
+
+    def product_json(query, kind, product, user_mask):
+        """JSON result for one looked-up barcode or name."""
+        if product is None:
+            return {"query": query, "type": kind, "found": False}
+        clash = user_mask & product.allergen_mask
+        return {
+            "query": query,
+            "type": kind,
+            "found": True,
+            "name": product.name,
+            "barcode": product.barcode,
+            "coords": [list(point) for point in product.coords],
+            "allergens": split_allergens(product.allergens),
+            "safe": not clash,
+            "unsafe_allergens": ALLERGENS.names(clash),
+        }
+
+    @app.route('/api/products/lookup', methods=['POST'])
+    def api_products_lookup():
+        """Looks up many barcodes and/or names in one request.
+
+        Body: {"barcodes": [...], "names": [...], "allergies": [...]}.
+        Returns coordinates, allergens and a safety verdict for each, in order.
+        """
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return jsonify(error="Expected a JSON object body."), 400
+
+        fields = {}
+        for key in ("barcodes", "names", "allergies"):
+            values = payload.get(key) or []
+            if isinstance(values, str):
+                values = [values]
+            if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+                return jsonify(error=f"'{key}' must be a list of strings."), 400
+            fields[key] = values
+
+        if len(fields["barcodes"]) + len(fields["names"]) > MAX_LOOKUP_ITEMS:
+            return jsonify(error=f"At most {MAX_LOOKUP_ITEMS} barcodes and names per request."), 400
+
+        catalog.refresh()
+        allergies = split_allergens(",".join(fields["allergies"]))
+        user_mask = ALLERGENS.mask(allergies)
+        by_barcode, by_name = catalog.lookup_many(fields["barcodes"], fields["names"])
+
+        results = [product_json(code, "barcode", product, user_mask)
+                   for code, product in zip(fields["barcodes"], by_barcode)]
+        results += [product_json(name, "name", product, user_mask)
+                    for name, product in zip(fields["names"], by_name)]
+        return jsonify(allergies=allergies, catalog_version=catalog.version, results=results)
+
+    @app.route('/api/lookup_cache', methods=['GET'])
+    def api_lookup_cache():
+        """Hit/miss counters of the lookup cache."""
+        return jsonify(lookup_cache.stats())
+
+    @app.route('/api/scanner', methods=['GET'])
+    def api_scanner():
+        """Per-camera frame and decoder counters, and how many scan jobs are running."""
+        return jsonify(scan_jobs.stats())
+
+    MAX_JOB_WAIT = 30.0
+
+    @app.route('/api/scan_jobs/<job_id>', methods=['GET'])
+    def api_scan_job(job_id):
+        """State and result of one scan job, including its time to decode.
+
+        With ?wait=<seconds> (up to MAX_JOB_WAIT) this long-polls: it answers
+        as soon as the job ends, or when the wait runs out. Polling keeps the
+        job from being abandoned.
+        """
+        job = scan_jobs.get(job_id)
+        if job is None:
+            return jsonify(error="Unknown scan job."), 404
+        wait = min(max(request.args.get("wait", 0.0, type=float), 0.0), MAX_JOB_WAIT)
+        if wait:
+            with job.watch():
+                job.wait(wait)
+        return jsonify(job.to_dict())
+
+    @app.route('/api/scan_jobs/<job_id>/cancel', methods=['POST'])
+    def api_cancel_scan_job(job_id):
+        """Stops a scan job; its camera stops too once no other job is scanning on it."""
+        job = scan_jobs.cancel(job_id)
+        if job is None:
+            return jsonify(error="Unknown scan job."), 404
+        return jsonify(job.to_dict())
 
     return app
 
@@ -1,12 +1,12 @@
-import requests
-from flask import Flask, Response, render_template_string
-import os
-import time
+from flask import Flask, Response, render_template_string, request
 import threading
 
 # --- NEW IMPORTS FOR BARCODE DECODING ---
-from PIL import Image
-from pyzbar.pyzbar import decode, ZBarSymbol
+from camera import CameraClient
+from decoding import FrameDecoder
+from frames import MJPEG_MIMETYPE, STREAM_HEADERS, FrameBuffer
+from motion import MotionScheduler
+from scanner import ScanPipeline
 
 # ----------------------------------------
 
@@ -17,7 +17,8 @@ ESP32_CAM_IP = "10.233.119.250"
 IMAGE_URL = f"http://{ESP32_CAM_IP}/"
 
 # --- File Save Configuration ---
-OUTPUT_FILENAME = "last_captured_barcode.jpg"
+# Frames are kept in memory; set this to also write the newest one to disk (off the scan path)
+OUTPUT_FILENAME = None
 
 # --- Global State for Scanning ---
 # Use a lock to safely control access to shared variables like the 'scanning' flag
@@ -26,103 +27,54 @@ lock = threading.Lock()
 scanning = True
 # Store the result so the web page can display it
 last_decoded_data = "Scanning..."
+# Most recent camera frames, served to the browser straight from memory
+frame_buffer = FrameBuffer(persist_path=OUTPUT_FILENAME)
 
 app = Flask(__name__)
 
 
-# --- Barcode Decoding Function (Remains the same) ---
+# --- Barcode Result Handling ---
 
-def decode_saved_image(image_path):
+def on_decoded(frame, results):
     """
-    Decodes barcodes and QR codes from the locally saved image file.
+    Called by the decode worker when a frame contains barcodes. Returns True to end the scan.
     """
-    global last_decoded_data
-    if not os.path.exists(image_path):
-        print(f"DECODE ERROR: Image file not found at {image_path}")
-        return False
-
-    try:
-        img = Image.open(image_path)
-        decoded_objects = decode(img, symbols=[ZBarSymbol.QRCODE, ZBarSymbol.EAN13, ZBarSymbol.CODE128])
-
-        if decoded_objects:
-            # Found a barcode!
-            print("\n--- BARCODE DECODED SUCCESSFULLY ---")
-            decoded_info = []
-            for obj in decoded_objects:
-                data = obj.data.decode('utf-8')
-                code_type = obj.type
-                print(f"DECODED TYPE: {code_type}")
-                print(f"DECODED DATA: {data}")
-                decoded_info.append(f"{code_type}: {data}")
-            print("------------------------------------\n")
-
-            with lock:
-                # Update global state and stop scanning
-                global scanning
-                scanning = False
-                last_decoded_data = "<br>".join(decoded_info)
-            return True  # Barcode found
-
-        else:
-            print("DECODE RESULT: No barcode or QR code found in the image. Continuing scan.")
-            return False  # No barcode found
-
-    except Exception as e:
-        print(f"FATAL DECODE ERROR: Could not process image. REASON: {e}")
-        return False
-
-
-# --- Continuous Scanning Loop (NEW) ---
-
-def continuous_scan_loop():
-    """
-    Runs in a separate thread. Continuously captures, saves, and decodes images.
-    """
-    global scanning
-    print("\n--- Starting Continuous Barcode Scanning Thread ---")
-
-    # Set a rate limit (e.g., capture one image per second)
-    SCAN_DELAY_SECONDS = 1.0
-
-    while True:
-        with lock:
-            if not scanning:
-                print("--- Scanning stopped due to successful decode or manual stop. ---")
-                break  # Exit the loop if scanning is set to False
-
-        print("-" * 30)
-        print(f"1. Attempting to fetch image from: {IMAGE_URL}")
-
-        # 1. Fetch Image from ESP32-CAM
-        try:
-            # Set a shorter timeout for quicker loop iterations
-            response = requests.get(IMAGE_URL, timeout=5)
-            response.raise_for_status()
-            image_bytes = response.content
-            print(f"2. Image fetched successfully. Size: {len(image_bytes)} bytes.")
-
-        except requests.exceptions.RequestException as e:
-            error_msg = f"ERROR: Could not fetch image from ESP32: {e}"
-            print(error_msg)
-            # Wait before trying again
-            time.sleep(SCAN_DELAY_SECONDS)
-            continue  # Go to the next loop iteration
-
-        # 2. Save Image Locally
-        try:
-            with open(OUTPUT_FILENAME, 'wb') as f:
-                f.write(image_bytes)
-            print(f"3. Image saved successfully as: {OUTPUT_FILENAME}")
-        except Exception as e:
-            print(f"ERROR: Could not save file {OUTPUT_FILENAME}: {e}")
-
-        # 3. ATTEMPT BARCODE DECODING
-        # decode_saved_image will handle updating the global 'scanning' flag if successful.
-        decode_saved_image(OUTPUT_FILENAME)
-
-        # 4. Wait for the next scan attempt
-        time.sleep(SCAN_DELAY_SECONDS)
+    global scanning, last_decoded_data
+    print("\n--- BARCODE DECODED SUCCESSFULLY ---")
+    decoded_info = []
+    for code_type, data in results:
+        print(f"DECODED TYPE: {code_type}")
+        print(f"DECODED DATA: {data}")
+        decoded_info.append(f"{code_type}: {data}")
+    print("------------------------------------\n")
+
+    with lock:
+        # Update global state and stop scanning
+        scanning = False
+        last_decoded_data = "<br>".join(decoded_info)
+    return True
+
+
+# --- Camera Connection ---
+# One keep-alive session; timeouts follow the measured frame time and failed
+# fetches reconnect with a jittered backoff
+camera = CameraClient(IMAGE_URL)
+
+# --- Decode Preprocessing ---
+# Region where customers hold products, as (left, top, right, bottom) fractions of the frame; None scans it all
+SCAN_ROI = None
+decoder = FrameDecoder(roi=SCAN_ROI)
+
+
+# --- Pipelined Scanning ---
+# Capture and decode run in separate workers: the camera fetches the next frame
+# while the current one decodes, and stale frames are skipped rather than queued.
+# Base rate limit (e.g., capture one image per second); motion in front of the
+# camera speeds capture up, an empty static scene slows it down
+SCAN_DELAY_SECONDS = 1.0
+scan_pipeline = ScanPipeline(camera.fetch, frame_buffer, on_decoded, capture_delay=SCAN_DELAY_SECONDS,
+                             decode=decoder.decode, retry_delay=camera.backoff,
+                             scheduler=MotionScheduler(SCAN_DELAY_SECONDS))
 
 
 # --- Flask Routes ---
@@ -134,7 +86,7 @@ def index():
     """
     Renders the HTML page to display the last captured image and the decoding status.
     """
-    # NOTE: The image displayed here is the *last saved* image from the background thread.
+    # NOTE: The image displayed here is the newest frame buffered by the background thread.
     return render_template_string(f"""
     <html>
         <head>
@@ -154,8 +106,8 @@ def index():
                 {last_decoded_data}
             </div>
 
-            <p>Last Image Captured:</p>
-            <img src="/latest_image">
+            <p>Live Camera Preview:</p>
+            <img src="/preview.mjpg">
             <p style="margin-top: 30px; color: #555;">The console shows detailed scan progress.</p>
         </body>
     </html>
@@ -165,26 +117,29 @@ def index():
 @app.route('/latest_image')
 def latest_image():
     """
-    Serves the most recently saved image file.
+    Serves the newest captured frame, straight from memory.
     """
-    try:
-        with open(OUTPUT_FILENAME, 'rb') as f:
-            image_bytes = f.read()
-        return Response(image_bytes, mimetype='image/jpeg')
-    except FileNotFoundError:
+    frame = frame_buffer.latest()
+    if frame is None:
         return Response("Waiting for first image capture...", status=404)
-    except Exception as e:
-        return Response(f"Error serving image: {e}", status=500)
+
+    # ETag from the frame sequence: unchanged frames get a bodiless 304
+    return frame_buffer.frame_response(frame, request)
+
+
+@app.route('/preview.mjpg')
+def preview_stream():
+    """
+    Live MJPEG preview. All viewers share the one capture loop; slow viewers skip frames.
+    """
+    return Response(frame_buffer.mjpeg_stream(idle_timeout=30.0), mimetype=MJPEG_MIMETYPE, headers=STREAM_HEADERS)
 
 
 # --- Execution ---
 
 if __name__ == '__main__':
-    # 1. Start the continuous scanning loop in a separate thread
-    scan_thread = threading.Thread(target=continuous_scan_loop)
-    # Set as daemon so the thread doesn't prevent the main program from exiting
-    scan_thread.daemon = True
-    scan_thread.start()
+    # 1. Start the capture and decode workers (daemon threads, so they don't block exit)
+    scan_pipeline.start()
 
     # 2. Run the Flask web server
     print("--- Starting Flask Web Server on http://0.0.0.0:5000 ---")
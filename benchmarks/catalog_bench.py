@@ -0,0 +1,208 @@
+"""Catalog lookup benchmark.
+
+Generates synthetic catalogs, then measures p50/p99 latency of the lookup
+helpers (called directly and through the Flask test client) and the
+memory/time to load each catalog. Every (size, backend) case runs in a
+fresh process so memory figures do not leak between cases. Results are
+written as JSON.
+
+    python benchmarks/catalog_bench.py --sizes 1000,100000,1000000 --output bench_output.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_catalog import ALLERGENS, synthetic_rows, write_catalog  # noqa: E402
+
+BACKENDS = ("csv", "bin", "sqlite")
+USER_ALLERGIES = ["Peanuts", "Milk (Dairy)"]
+# Share of lookups for products that do not exist
+MISS_RATE = 0.1
+
+
+def _rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]  # noqa: E731
+    return {
+        "n": len(ordered),
+        "p50_us": round(pick(0.50) * 1e6, 2),
+        "p99_us": round(pick(0.99) * 1e6, 2),
+        "max_us": round(ordered[-1] * 1e6, 2),
+        "mean_us": round(sum(ordered) / len(ordered) * 1e6, 2),
+    }
+
+
+def _time_calls(fn, args_list):
+    samples = []
+    clock = time.perf_counter
+    for args in args_list:
+        start = clock()
+        fn(*args)
+        samples.append(clock() - start)
+    return _percentiles(samples)
+
+
+def _queries(size, count, seed):
+    """Names and barcodes to look up: mostly known products, MISS_RATE unknown ones."""
+    rng = random.Random(seed + 1)
+    picks = sorted(rng.sample(range(size), min(count, size)))
+    wanted = set(picks)
+    known = [(row["Name"], row["Barcode"]) for i, row in enumerate(synthetic_rows(size, seed)) if i in wanted]
+    rng.shuffle(known)
+    names, barcodes = [], []
+    for i in range(count):
+        if rng.random() < MISS_RATE:
+            names.append(f"Unknown Product {i}")
+            barcodes.append(f"9{i:012d}")
+        else:
+            name, barcode = known[i % len(known)]
+            names.append(name)
+            barcodes.append(barcode)
+    return names, barcodes
+
+
+def run_case(size, backend, queries, seed, workdir):
+    """Runs one (size, backend) case. Meant to be called in a fresh process."""
+    # Keep the app's progress prints out of the JSON on stdout
+    sys.stdout = sys.stderr
+    import app2
+    from catalog import ALLERGENS as allergen_registry
+    from scanner import ScanJob
+
+    csv_file = os.path.join(workdir, f"products_{size}.csv")
+    catalog_file = csv_file
+    if backend == "bin":
+        from catalog_binary import build_catalog
+        catalog_file = os.path.join(workdir, f"products_{size}.bin")
+        if not os.path.exists(catalog_file):
+            build_catalog(csv_file, catalog_file)
+    elif backend == "sqlite":
+        from catalog_sqlite import import_catalog
+        catalog_file = os.path.join(workdir, f"products_{size}.db")
+        if not os.path.exists(catalog_file):
+            import_catalog(csv_file, catalog_file)
+
+    names, barcodes = _queries(size, queries, seed)
+
+    rss_before = _rss_mb()
+    started = time.perf_counter()
+    app = app2.create_app({"CSV_FILE": csv_file, "CATALOG_FILE": catalog_file})
+    load_seconds = time.perf_counter() - started
+    rss_after = _rss_mb()
+
+    helpers = app.extensions["product_lookup"]
+    user_mask = allergen_registry.mask(USER_ALLERGIES)
+    masks = [helpers["search_product_by_barcode"](code)[1] for code in barcodes[:1000]]
+    masks = [m for m in masks if m is not None] or [0]
+
+    results = {
+        "size": size,
+        "backend": backend,
+        "load_seconds": round(load_seconds, 4),
+        "load_rss_mb": None if rss_before is None else round(rss_after - rss_before, 1),
+        "peak_rss_mb": None if rss_after is None else round(rss_after, 1),
+        "direct": {
+            "search_product_by_name": _time_calls(helpers["search_product_by_name"], [(n,) for n in names]),
+            "search_product_by_barcode": _time_calls(helpers["search_product_by_barcode"], [(b,) for b in barcodes]),
+            "check_safety": _time_calls(helpers["check_safety"], [(user_mask, m) for m in masks] * 10),
+        },
+    }
+
+    # Through the Flask test client (routing, cache, templates and redirects included)
+    client = app.test_client()
+    allergy = ",".join(USER_ALLERGIES)
+
+    def post_product(name):
+        client.post("/product", query_string={"name": "Bench", "allergy": allergy}, data={"product": name})
+
+    scan_jobs = app.extensions["scan_jobs"]
+
+    def scanner_status(barcode):
+        # A finished job, as if the camera had just read this barcode
+        job = scan_jobs.add(ScanJob(f"bench-{barcode}", scan_jobs.default_camera))
+        job.finish("EAN13", barcode)
+        client.get("/scanner_status", query_string={"job": job.id, "name": "Bench", "allergy": allergy})
+
+    def api_lookup(barcode):
+        client.post("/api/products/lookup", json={"barcodes": [barcode], "allergies": USER_ALLERGIES})
+
+    results["flask"] = {
+        "POST /product": _time_calls(post_product, [(n,) for n in names]),
+        "GET /scanner_status": _time_calls(scanner_status, [(b,) for b in barcodes]),
+        "POST /api/products/lookup": _time_calls(api_lookup, [(b,) for b in barcodes]),
+        "lookup_cache": app.extensions["lookup_cache"].stats(),
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark catalog lookups on synthetic catalogs.")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="comma-separated catalog sizes")
+    parser.add_argument("--backends", default="csv,bin", help=f"comma-separated, from {', '.join(BACKENDS)}")
+    parser.add_argument("--queries", type=int, default=2000, help="lookups per operation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="where synthetic catalogs are kept (default: a temp dir)")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    backends = [b for b in args.backends.split(",") if b]
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f"unknown backend(s): {', '.join(sorted(unknown))}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="catalog_bench_")
+    os.makedirs(workdir, exist_ok=True)
+
+    report = {
+        "benchmark": "catalog_lookup",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "queries": args.queries,
+        "allergies": USER_ALLERGIES,
+        "allergen_vocabulary": ALLERGENS,
+        "cases": [],
+    }
+    # A fresh interpreter per case keeps load and RSS figures independent
+    ctx = multiprocessing.get_context("spawn")
+    for size in sizes:
+        csv_file = os.path.join(workdir, f"products_{size}.csv")
+        if not os.path.exists(csv_file):
+            print(f"--- Generating {size} products ---", file=sys.stderr)
+            write_catalog(csv_file, size, args.seed)
+        for backend in backends:
+            print(f"--- Benchmarking {size} products, {backend} backend ---", file=sys.stderr)
+            with ctx.Pool(1) as pool:
+                report["cases"].append(pool.apply(run_case, (size, backend, args.queries, args.seed, workdir)))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
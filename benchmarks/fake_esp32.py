@@ -0,0 +1,186 @@
+"""Offline stand-in for the ESP32-CAM's snapshot server (snapshot_handler in ESP32.py).
+
+GET / answers like the camera: a JPEG with Content-Type image/jpeg and a
+Content-Length header, sent as one chunk plus the terminating empty chunk,
+or a 500 when the frame grab fails. Frames come from a recorded sequence
+(a directory of JPEGs, played in name order) or a synthetic scene, and are
+picked by wall-clock time since the last reset, so a slow client misses
+frames the way it would with a real camera.
+
+Latency, jitter and failures are configurable: each request waits
+latency +/- jitter seconds; `failure_rate` of them get a 500 and
+`drop_rate` have the connection closed without a response (Wi-Fi dropping).
+
+    python benchmarks/fake_esp32.py --frames recorded/ --fps 10 --latency 0.08 --jitter 0.03 --failure-rate 0.05
+
+GET /reset restarts the sequence and GET /stats reports request counts.
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_FPS = 10
+
+
+def load_frames(directory):
+    """The JPEG files in `directory`, in name order, as bytes."""
+    paths = sorted(glob.glob(os.path.join(directory, "*.jpg")) + glob.glob(os.path.join(directory, "*.jpeg")))
+    if not paths:
+        raise FileNotFoundError(f"No .jpg frames in {directory}")
+    frames = []
+    for path in paths:
+        with open(path, "rb") as f:
+            frames.append(f.read())
+    return frames
+
+
+class FakeCamera:
+    """Frame timeline plus fault injection, shared by every request handler."""
+
+    def __init__(self, frames, fps=DEFAULT_FPS, latency=0.0, jitter=0.0, failure_rate=0.0, drop_rate=0.0,
+                 loop=False, seed=0):
+        self.frames = list(frames)
+        self.fps = fps
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.loop = loop
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.monotonic()
+            self.requests = 0
+            self.served = 0
+            self.failures = 0
+            self.drops = 0
+
+    def current_frame(self):
+        """Index of the frame the sensor is showing right now."""
+        index = int((time.monotonic() - self.started_at) * self.fps)
+        return index % len(self.frames) if self.loop else min(index, len(self.frames) - 1)
+
+    def next_outcome(self):
+        """Decides one request's fate: (delay seconds, "ok" | "fail" | "drop")."""
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            roll = self._rng.random()
+            if roll < self.drop_rate:
+                self.drops += 1
+                return delay, "drop"
+            if roll < self.drop_rate + self.failure_rate:
+                self.failures += 1
+                return delay, "fail"
+            self.served += 1
+            return delay, "ok"
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "served": self.served,
+                "failures": self.failures,
+                "drops": self.drops,
+                "frame": self.current_frame(),
+                "frames": len(self.frames),
+            }
+
+
+class SnapshotHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like esp_http_server
+    protocol_version = "HTTP/1.1"
+    camera = None
+
+    def do_GET(self):
+        if self.path == "/reset":
+            self.camera.reset()
+            return self._send(200, "application/json", b'{"reset": true}')
+        if self.path == "/stats":
+            return self._send(200, "application/json", json.dumps(self.camera.stats()).encode())
+        if self.path.split("?")[0] != "/":
+            return self._send(404, "text/plain", b"Not found")
+
+        delay, outcome = self.camera.next_outcome()
+        time.sleep(delay)
+        if outcome == "drop":
+            self.close_connection = True
+            return
+        if outcome == "fail":
+            # httpd_resp_send_500(req) after esp_camera_fb_get() returned NULL
+            return self._send(500, "text/html", b"500 Internal Server Error")
+
+        jpeg = self.camera.frames[self.camera.current_frame()]
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(jpeg)))
+        # httpd_resp_send_chunk() switches the response to chunked encoding
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.wfile.write(f"{len(jpeg):X}\r\n".encode() + jpeg + b"\r\n0\r\n\r\n")
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(camera, host="127.0.0.1", port=0):
+    """Serves `camera` from a daemon thread. Returns (server, base URL); stop with server.shutdown()."""
+    handler = type("BoundSnapshotHandler", (SnapshotHandler,), {"camera": camera})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-esp32", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recorded or synthetic frames like an ESP32-CAM.")
+    parser.add_argument("--frames", help="directory of recorded JPEG frames (default: a synthetic scene)")
+    parser.add_argument("--code", help="EAN-13 on the synthetic product")
+    parser.add_argument("--fps", type=float, default=DEFAULT_FPS, help="rate the sequence was recorded at")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before each response")
+    parser.add_argument("--jitter", type=float, default=0.02, help="+/- seconds added to the latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests answered with 500")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="share of connections closed without a response")
+    parser.add_argument("--loop", action="store_true", help="replay the sequence instead of holding the last frame")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.frames:
+        frames = load_frames(args.frames)
+    else:
+        from synthetic_catalog import ean13
+        from synthetic_frames import scene_frames
+        frames = [jpeg for _t, jpeg in scene_frames(args.code or ean13(500000000000), fps=args.fps, seed=args.seed)]
+    camera = FakeCamera(frames, fps=args.fps, latency=args.latency, jitter=args.jitter,
+                        failure_rate=args.failure_rate, drop_rate=args.drop_rate, loop=args.loop, seed=args.seed)
+    server, url = start_server(camera, args.host, args.port)
+    print(f"--- Fake ESP32-CAM serving {len(frames)} frames at {url} ---")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        print("--- Fake ESP32-CAM stopped. ---")
+
+
+if __name__ == '__main__':
+    main()
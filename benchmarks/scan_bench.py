@@ -0,0 +1,245 @@
+"""Scan pipeline benchmark against a fake ESP32-CAM.
+
+Serves a recorded (or synthetic) sequence in which a product is presented
+to the camera from benchmarks/fake_esp32.py, then runs repeated scans for
+every combination of preprocessing and pipeline setting and reports
+time-to-first-decode, frames fetched and decoded per scan, and client CPU
+per scan. The fake camera runs in this process and every case in a fresh
+one, so CPU figures only cover the scanning side. Results are written as
+JSON.
+
+Preprocessing: "full" (whole colour frame, no preprocessing), "downscale"
+(FrameDecoder's downscaled first pass and targeted retry), "dedup" (plus
+duplicate-frame skipping, the default) and "roi" (plus a centre region of
+interest). Pipeline: "sequential" (the original continuous_scan_loop:
+new connection per frame, save, decode, sleep), "pipelined" (ScanPipeline
+with a keep-alive CameraClient) and "adaptive" (plus MotionScheduler).
+With --decode-backend process, FrameDecoder runs in a worker process whose
+CPU time is not included.
+
+    python benchmarks/scan_bench.py --scans 5 --latency 0.08 --jitter 0.03 --failure-rate 0.05 --output scan_bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_esp32 import FakeCamera, load_frames, start_server  # noqa: E402
+from synthetic_catalog import ean13  # noqa: E402
+from synthetic_frames import scene_frames  # noqa: E402
+
+PREPROCESSING = ("full", "downscale", "dedup", "roi")
+PIPELINES = ("sequential", "pipelined", "adaptive")
+# Region of interest for the "roi" case: the middle of the frame, where products are held
+CENTRE_ROI = (0.2, 0.2, 0.8, 0.8)
+
+
+def _decoder(preprocess, pool):
+    from decoding import FrameDecoder, decode_jpeg
+    if preprocess == "full":
+        return decode_jpeg, None
+    decoder = FrameDecoder(
+        dedup_distance=None if preprocess == "downscale" else 1,
+        roi=CENTRE_ROI if preprocess == "roi" else None,
+        pool=pool,
+    )
+    return decoder.decode, decoder
+
+
+def _sequential_scan(url, decode, expected, delay, timeout, workdir):
+    """The original loop: requests.get, save to disk, decode the file, sleep."""
+    import requests
+    output_file = os.path.join(workdir, "latest_capture.jpg")
+    started = time.monotonic()
+    scan = {"frames_captured": 0, "frames_decoded": 0, "capture_errors": 0, "wrong_reads": 0,
+            "time_to_first_decode": None}
+    while time.monotonic() - started < timeout:
+        try:
+            response = requests.get(url, timeout=5)
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            scan["capture_errors"] += 1
+            time.sleep(delay * 2)
+            continue
+        scan["frames_captured"] += 1
+        with open(output_file, "wb") as f:
+            f.write(response.content)
+        with open(output_file, "rb") as f:
+            results = decode(f.read())
+        scan["frames_decoded"] += 1
+        if any(result.data == expected for result in results):
+            scan["time_to_first_decode"] = time.monotonic() - started
+            break
+        scan["wrong_reads"] += bool(results)
+        time.sleep(delay)
+    return scan
+
+
+def _pipelined_scan(client, decode, expected, delay, timeout, scheduler):
+    from frames import FrameBuffer
+    from scanner import ScanPipeline
+    scan = {"wrong_reads": 0, "time_to_first_decode": None}
+
+    def on_result(frame, results):
+        if any(result.data == expected for result in results):
+            scan["time_to_first_decode"] = time.monotonic() - pipeline.started_at
+            return True
+        scan["wrong_reads"] += 1
+        return False
+
+    pipeline = ScanPipeline(client.fetch, FrameBuffer(), on_result, capture_delay=delay, decode=decode,
+                            retry_delay=client.backoff, scheduler=scheduler).start()
+    while pipeline.running and time.monotonic() - pipeline.started_at < timeout:
+        time.sleep(0.01)
+    pipeline.stop()
+    pipeline.join()
+    scan.update(frames_captured=pipeline.frames_captured, frames_decoded=pipeline.frames_decoded,
+                capture_errors=pipeline.capture_errors)
+    return scan
+
+
+def run_case(preprocess, pipeline, url, expected, scans, delay, timeout, decode_backend):
+    """Runs `scans` scans for one (preprocess, pipeline) case. Meant to be called in a fresh process."""
+    # Keep the pipeline's progress prints out of the JSON on stdout
+    sys.stdout = sys.stderr
+    import requests
+    from camera import CameraClient
+    from decoding import make_decode_pool
+    from motion import MotionScheduler
+
+    pool = make_decode_pool(decode_backend, workers=1)
+    decode, decoder = _decoder(preprocess, pool)
+    client = CameraClient(url)
+    scheduler = MotionScheduler(delay) if pipeline == "adaptive" else None
+    workdir = tempfile.mkdtemp(prefix="scan_bench_")
+
+    results = []
+    for _ in range(scans):
+        # Every scan starts from an empty scene; the product appears a little later
+        requests.get(url + "reset", timeout=5).raise_for_status()
+        cpu_start = time.process_time()
+        if pipeline == "sequential":
+            scan = _sequential_scan(url, decode, expected, delay, timeout, workdir)
+        else:
+            scan = _pipelined_scan(client, decode, expected, delay, timeout, scheduler)
+        scan["cpu_seconds"] = time.process_time() - cpu_start
+        results.append(scan)
+    client.close()
+    if pool is not None:
+        pool.shutdown()
+
+    found = [scan["time_to_first_decode"] for scan in results if scan["time_to_first_decode"] is not None]
+    mean = lambda key: sum(scan[key] for scan in results) / len(results)  # noqa: E731
+    return {
+        "preprocess": preprocess,
+        "pipeline": pipeline,
+        "decode_backend": decode_backend,
+        "scans": scans,
+        "decoded_scans": len(found),
+        "time_to_first_decode": {
+            "p50_s": round(sorted(found)[len(found) // 2], 3) if found else None,
+            "max_s": round(max(found), 3) if found else None,
+            "mean_s": round(sum(found) / len(found), 3) if found else None,
+        },
+        "frames_captured_per_scan": round(mean("frames_captured"), 2),
+        "frames_decoded_per_scan": round(mean("frames_decoded"), 2),
+        "frames_per_decode": round(sum(s["frames_captured"] for s in results) / len(found), 2) if found else None,
+        "capture_errors_per_scan": round(mean("capture_errors"), 2),
+        "wrong_reads": sum(scan["wrong_reads"] for scan in results),
+        "cpu_ms_per_scan": round(mean("cpu_seconds") * 1000, 1),
+        "decoder": decoder.stats() if decoder else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scan pipeline against a fake ESP32-CAM.")
+    parser.add_argument("--frames", help="directory of recorded JPEG frames (default: a synthetic scene)")
+    parser.add_argument("--code", help="barcode expected in the frames (default: the synthetic product's)")
+    parser.add_argument("--fps", type=float, default=10, help="rate the sequence was recorded at")
+    parser.add_argument("--present-at", type=float, default=1.0, help="synthetic scene: seconds before the product appears")
+    parser.add_argument("--module-px", type=int, default=3, help="synthetic scene: bar width in pixels")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--preprocess", default=",".join(PREPROCESSING), help=f"comma-separated, from {', '.join(PREPROCESSING)}")
+    parser.add_argument("--pipelines", default=",".join(PIPELINES), help=f"comma-separated, from {', '.join(PIPELINES)}")
+    parser.add_argument("--decode-backend", default="thread", choices=("thread", "process"),
+                        help="where FrameDecoder's passes run (\"full\" always decodes in the thread)")
+    parser.add_argument("--scans", type=int, default=5, help="scans per case")
+    parser.add_argument("--delay", type=float, default=0.5, help="capture delay in seconds (adaptive: the base delay)")
+    parser.add_argument("--timeout", type=float, default=10.0, help="give up on a scan after this many seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    preprocess = [p for p in args.preprocess.split(",") if p]
+    pipelines = [p for p in args.pipelines.split(",") if p]
+    unknown = (set(preprocess) - set(PREPROCESSING)) | (set(pipelines) - set(PIPELINES))
+    if unknown:
+        parser.error(f"unknown setting(s): {', '.join(sorted(unknown))}")
+
+    if args.frames:
+        if not args.code:
+            parser.error("--code is required with --frames")
+        expected, frames = args.code, load_frames(args.frames)
+    else:
+        expected = args.code or ean13(500000000000)
+        print("--- Rendering synthetic scene ---", file=sys.stderr)
+        frames = [jpeg for _t, jpeg in scene_frames(expected, seconds=args.present_at + 3, fps=args.fps,
+                                                    present_at=args.present_at, module_px=args.module_px,
+                                                    seed=args.seed)]
+    camera = FakeCamera(frames, fps=args.fps, latency=args.latency, jitter=args.jitter,
+                        failure_rate=args.failure_rate, drop_rate=args.drop_rate, seed=args.seed)
+    server, url = start_server(camera)
+
+    report = {
+        "benchmark": "scan_pipeline",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "camera": {
+            "frames": len(frames),
+            "fps": args.fps,
+            "source": args.frames or "synthetic",
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "failure_rate": args.failure_rate,
+            "drop_rate": args.drop_rate,
+        },
+        "expected": expected,
+        "delay": args.delay,
+        "cases": [],
+    }
+    # A fresh interpreter per case keeps CPU figures and decoder state independent
+    ctx = multiprocessing.get_context("spawn")
+    try:
+        for pre in preprocess:
+            for pipeline in pipelines:
+                print(f"--- Benchmarking {pre} preprocessing, {pipeline} pipeline ---", file=sys.stderr)
+                # An executor rather than multiprocessing.Pool: its worker may start decode processes of its own
+                with ProcessPoolExecutor(1, mp_context=ctx) as pool:
+                    report["cases"].append(pool.submit(run_case, pre, pipeline, url, expected, args.scans,
+                                                       args.delay, args.timeout, args.decode_backend).result())
+    finally:
+        server.shutdown()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import csv
+import random
+
+# Vocabulary for plausible supermarket product names
+BRANDS = ["Tesco", "Asda", "Heinz", "Warburtons", "Hovis", "Kellogg's", "Cadbury", "Walkers",
+          "Muller", "Arla", "Quaker", "Nestle", "Birds Eye", "McVitie's", "Yeo Valley", "Alpro"]
+DESCRIPTORS = ["Semi-Skimmed", "Whole", "Wholemeal", "Organic", "Free Range", "Smoked", "Salted",
+               "Unsalted", "Low Fat", "Original", "Mature", "Greek Style", "Crunchy", "Smooth",
+               "Sourdough", "Granary", "Lightly Salted", "Dark", "Milk", "Sweet Chilli"]
+PRODUCTS = ["Milk", "Bread", "Butter", "Cheddar", "Yoghurt", "Eggs", "Rice", "Pasta", "Penne",
+            "Cereal", "Porridge Oats", "Biscuits", "Crisps", "Chocolate", "Peanut Butter", "Salmon",
+            "Tuna Chunks", "Baked Beans", "Tomato Soup", "Orange Juice", "Granola", "Hummus",
+            "Soy Sauce", "Sesame Bagels", "Prawn Crackers", "Almond Drink", "Fish Fingers"]
+SIZES = ["100g", "200g", "250g", "400g", "500g", "750g", "800g", "1kg", "1L", "2L", "4 Pack", "6 Pack"]
+ALLERGENS = ["Milk (Dairy)", "Eggs", "Peanuts", "Tree Nuts", "Soy", "Wheat", "Fish", "Shellfish", "Sesame"]
+
+
+def ean13(number):
+    """12-digit number plus its EAN-13 check digit."""
+    digits = f"{number:012d}"
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits))
+    return digits + str((10 - total % 10) % 10)
+
+
+def _point(rng):
+    return f"({rng.uniform(0, 40):.2f}, {rng.uniform(0, 25):.2f}, {rng.uniform(0, 2):.2f})"
+
+
+def synthetic_rows(count, seed=0):
+    """Yields products.csv rows: unique EAN-13 barcodes, names, tuple coordinates and allergens."""
+    rng = random.Random(seed)
+    for i in range(count):
+        name = f"{rng.choice(BRANDS)} {rng.choice(DESCRIPTORS)} {rng.choice(PRODUCTS)} {rng.choice(SIZES)}"
+        if i >= len(BRANDS) * len(PRODUCTS):
+            # Keep names unique at large sizes, like real SKU descriptions
+            name = f"{name} #{i}"
+        allergens = ", ".join(rng.sample(ALLERGENS, rng.choice((0, 0, 1, 1, 2, 3)))) or "None"
+        yield {
+            "Name": name,
+            "Barcode": ean13(500000000000 + i),
+            "X": _point(rng),
+            "Y": _point(rng),
+            "Z": _point(rng),
+            "Allergy": allergens,
+        }
+
+
+def write_catalog(path, count, seed=0):
+    """Writes a synthetic products.csv with `count` rows."""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["Name", "Barcode", "X", "Y", "Z", "Allergy"])
+        writer.writeheader()
+        writer.writerows(synthetic_rows(count, seed))
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic products.csv.")
+    parser.add_argument("output")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_catalog(args.output, args.rows, args.seed)
+    print(f"--- Wrote {args.rows} products to {args.output} ---")
@@ -0,0 +1,114 @@
+"""Synthetic ESP32-CAM footage: an aisle scene where a customer presents a product.
+
+Frames are SVGA (800x600) JPEGs like the ESP32-CAM's. The scene is empty
+(with sensor noise) until `present_at`; the product, an EAN-13 label,
+then slides in over `slide_seconds` and is held with a slight wobble.
+
+    python benchmarks/synthetic_frames.py frames/ --seconds 4 --fps 10
+"""
+import argparse
+import io
+import os
+import random
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from synthetic_catalog import ean13
+
+FRAME_SIZE = (800, 600)
+
+# --- EAN-13 symbol tables ---
+L_CODES = ["0001101", "0011001", "0010011", "0111101", "0100011",
+           "0110001", "0101111", "0111011", "0110111", "0001011"]
+R_CODES = ["".join("1" if bit == "0" else "0" for bit in code) for code in L_CODES]
+G_CODES = [code[::-1] for code in R_CODES]
+PARITY = ["LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG",
+          "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL"]
+QUIET_MODULES = 9
+
+
+def ean13_modules(code):
+    """The 95 bar/space modules of an EAN-13 code, as a "1"/"0" string."""
+    digits = [int(d) for d in code]
+    left = "".join((L_CODES if parity == "L" else G_CODES)[d] for parity, d in zip(PARITY[digits[0]], digits[1:7]))
+    right = "".join(R_CODES[d] for d in digits[7:])
+    return "101" + left + "01010" + right + "101"
+
+
+def ean13_label(code, module_px=3, bar_height=90):
+    """A white product label with the barcode and its digits' quiet zones."""
+    modules = ean13_modules(code)
+    width = (len(modules) + 2 * QUIET_MODULES) * module_px
+    label = Image.new("L", (width, bar_height + 2 * module_px * 4), 255)
+    draw = ImageDraw.Draw(label)
+    for i, bit in enumerate(modules):
+        if bit == "1":
+            x = (QUIET_MODULES + i) * module_px
+            draw.rectangle([x, module_px * 4, x + module_px - 1, module_px * 4 + bar_height], fill=0)
+    return label
+
+
+def _background(rng):
+    img = Image.new("L", FRAME_SIZE, 118)
+    draw = ImageDraw.Draw(img)
+    # Shelving
+    for y in (150, 330, 510):
+        draw.rectangle([0, y, FRAME_SIZE[0], y + 14], fill=70)
+    for _ in range(12):
+        x, y = rng.randrange(0, 760), rng.choice((60, 240, 420))
+        draw.rectangle([x, y, x + 40, y + 85], fill=rng.randrange(60, 200))
+    return img
+
+
+def scene_frames(code, seconds=4.0, fps=10, present_at=1.0, slide_seconds=0.5, module_px=3,
+                 noise=6, quality=80, seed=0):
+    """Yields (timestamp, jpeg bytes) for a customer presenting a product labelled with `code`."""
+    rng = random.Random(seed)
+    background = _background(rng)
+    label = ean13_label(code, module_px)
+    rest_x = (FRAME_SIZE[0] - label.width) // 2
+    rest_y = (FRAME_SIZE[1] - label.height) // 2
+    for i in range(int(seconds * fps)):
+        t = i / fps
+        frame = background.copy()
+        if t >= present_at:
+            # Slides in from the right, then wobbles a little in the customer's hand
+            progress = min(1.0, (t - present_at) / slide_seconds) if slide_seconds else 1.0
+            x = int(FRAME_SIZE[0] + (rest_x - FRAME_SIZE[0]) * progress) + rng.randint(-3, 3)
+            y = rest_y + rng.randint(-3, 3)
+            frame.paste(label, (x, y))
+            if progress < 1.0:
+                frame = frame.filter(ImageFilter.BoxBlur(2))
+        if noise:
+            grain = Image.effect_noise(FRAME_SIZE, noise * 4).point(lambda v: v - 128)
+            frame = Image.blend(frame, grain.convert("L"), 0.04)
+        buf = io.BytesIO()
+        frame.convert("RGB").save(buf, "JPEG", quality=quality)
+        yield t, buf.getvalue()
+
+
+def write_frames(directory, code, **options):
+    """Writes a scene as frame_0000.jpg, frame_0001.jpg, ... Returns the file paths."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i, (_t, jpeg) in enumerate(scene_frames(code, **options)):
+        path = os.path.join(directory, f"frame_{i:04d}.jpg")
+        with open(path, "wb") as f:
+            f.write(jpeg)
+        paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render a synthetic ESP32-CAM scene as JPEG files.")
+    parser.add_argument("output", help="directory for the frames")
+    parser.add_argument("--code", default=ean13(500000000000), help="EAN-13 printed on the product")
+    parser.add_argument("--seconds", type=float, default=4.0)
+    parser.add_argument("--fps", type=int, default=10)
+    parser.add_argument("--present-at", type=float, default=1.0)
+    parser.add_argument("--module-px", type=int, default=3, help="bar width in pixels; 1-2 makes a small barcode")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    written = write_frames(args.output, args.code, seconds=args.seconds, fps=args.fps,
+                           present_at=args.present_at, module_px=args.module_px, seed=args.seed)
+    print(f"--- Wrote {len(written)} frames to {args.output} ---")
@@ -0,0 +1,217 @@
+import asyncio
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- Timeout tuning (seconds) ---
+# The ESP32-CAM is on the local network, so connecting should be quick
+CONNECT_TIMEOUT = 2.0
+# Read timeout before any frame has been timed
+INITIAL_READ_TIMEOUT = 5.0
+# The adaptive read timeout is READ_TIMEOUT_FACTOR x the typical frame time, within these bounds
+MIN_READ_TIMEOUT = 1.0
+MAX_READ_TIMEOUT = 10.0
+READ_TIMEOUT_FACTOR = 4.0
+# Weight of the newest sample in the moving average of frame times
+FRAME_TIME_SMOOTHING = 0.2
+
+# --- Reconnect backoff (seconds) ---
+BACKOFF_BASE = 0.25
+BACKOFF_MAX = 8.0
+
+
+class CameraTiming:
+    """Frame-time tracking, adaptive read timeout and reconnect backoff shared by the camera clients."""
+
+    def __init__(self, url, connect_timeout=CONNECT_TIMEOUT, rng=None):
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self._rng = rng or random.Random()
+        self.frame_time = None
+        self.failures = 0
+        self.fetches = 0
+        self.reconnects = 0
+
+    @property
+    def read_timeout(self):
+        if self.frame_time is None:
+            return INITIAL_READ_TIMEOUT
+        return min(MAX_READ_TIMEOUT, max(MIN_READ_TIMEOUT, self.frame_time * READ_TIMEOUT_FACTOR))
+
+    def _record_success(self, elapsed):
+        if self.frame_time is None:
+            self.frame_time = elapsed
+        else:
+            self.frame_time += FRAME_TIME_SMOOTHING * (elapsed - self.frame_time)
+        self.failures = 0
+        self.fetches += 1
+
+    def _record_failure(self):
+        self.failures += 1
+        self.reconnects += 1
+
+    def backoff(self):
+        """Delay before retrying: doubles with each consecutive failure, randomised so retries spread out."""
+        ceiling = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** max(0, self.failures - 1)))
+        return ceiling / 2 + self._rng.uniform(0, ceiling / 2)
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "fetches": self.fetches,
+            "consecutive_failures": self.failures,
+            "reconnects": self.reconnects,
+            "frame_time": self.frame_time,
+            "read_timeout": self.read_timeout,
+        }
+
+
+class CameraClient(CameraTiming):
+    """Fetches snapshots from an ESP32-CAM over one long-lived keep-alive session.
+
+    Reusing the connection saves a TCP handshake per frame, a large share of
+    the per-frame time on the camera's small HTTP server. The read timeout
+    follows a moving average of measured frame times. After a failure the
+    session is dropped, and `backoff()` gives a jittered, growing delay
+    before the next attempt.
+    """
+
+    def __init__(self, url, connect_timeout=CONNECT_TIMEOUT, rng=None):
+        super().__init__(url, connect_timeout, rng)
+        self._lock = threading.Lock()
+        self._session = None
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                # One camera, one connection: no retries here, the caller backs off instead
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=0)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def close(self):
+        """Drops the pooled connection; the next fetch reconnects."""
+        with self._lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
+
+    def fetch(self):
+        """Returns one JPEG snapshot. Raises requests.exceptions.RequestException on failure."""
+        session = self._get_session()
+        started = time.monotonic()
+        try:
+            response = session.get(self.url, timeout=(self.connect_timeout, self.read_timeout))
+            response.raise_for_status()
+            jpeg = response.content
+        except requests.exceptions.RequestException:
+            self._record_failure()
+            # A half-read or refused connection is not worth keeping in the pool
+            self.close()
+            raise
+
+        self._record_success(time.monotonic() - started)
+        return jpeg
+
+
+class CameraError(Exception):
+    """A camera fetch failed: connection refused or dropped, timeout, or a non-200 reply."""
+
+
+class AsyncCameraClient(CameraTiming):
+    """asyncio counterpart of CameraClient, for fetching from many cameras on one event loop.
+
+    Speaks just enough HTTP/1.1 for the ESP32-CAM snapshot handler: a GET
+    over a kept-alive connection, with Content-Length or chunked bodies.
+    Timing and backoff behave exactly as in CameraClient.
+    """
+
+    def __init__(self, url, connect_timeout=CONNECT_TIMEOUT, rng=None):
+        super().__init__(url, connect_timeout, rng)
+        parts = urlsplit(url)
+        if parts.scheme != "http":
+            raise ValueError(f"Only http:// camera URLs are supported, got {url!r}")
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        self._reader = None
+        self._writer = None
+
+    async def close(self):
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def _request(self):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.connect_timeout
+            )
+        self._writer.write(
+            f"GET {self.path} HTTP/1.1\r\nHost: {self.host}\r\nConnection: keep-alive\r\n\r\n".encode("ascii")
+        )
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise CameraError("connection closed by camera")
+        parts = status_line.decode("latin-1").split(None, 2)
+        if len(parts) < 2 or not parts[1].isdigit():
+            raise CameraError(f"bad status line {status_line!r}")
+        status = int(parts[1])
+
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self._reader.readline()).split(b";")[0].strip() or b"0", 16)
+                if not size:
+                    await self._reader.readline()
+                    break
+                chunks.append(await self._reader.readexactly(size))
+                await self._reader.readline()
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await self._reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await self._reader.read()
+            await self.close()
+
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        if status != 200:
+            raise CameraError(f"HTTP {status} from {self.url}")
+        return body
+
+    async def fetch(self):
+        """Returns one JPEG snapshot. Raises CameraError on failure."""
+        started = time.monotonic()
+        try:
+            jpeg = await asyncio.wait_for(self._request(), self.connect_timeout + self.read_timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, CameraError) as e:
+            self._record_failure()
+            await self.close()
+            if isinstance(e, CameraError):
+                raise
+            raise CameraError(f"{type(e).__name__}: {e}" if str(e) else type(e).__name__) from e
+
+        self._record_success(time.monotonic() - started)
+        return jpeg
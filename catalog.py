@@ -0,0 +1,524 @@
+import csv
+import math
+import os
+import threading
+import time
+import weakref
+from array import array
+from collections import namedtuple
+from contextlib import nullcontext
+
+from search_index import NameSearchIndex
+
+# --- Records returned by catalog lookups ---
+Point = namedtuple("Point", ["x", "y", "z"])
+Coordinates = namedtuple("Coordinates", ["x", "y", "z"])
+Product = namedtuple("Product", ["id", "name", "barcode", "coords", "allergens", "allergen_mask"])
+
+# How often (seconds) lookups are allowed to stat the CSV for changes
+RELOAD_CHECK_SECONDS = 1.0
+
+# Coordinate columns in products.csv, each holding an "(a, b, c)" tuple string
+COORD_COLUMNS = ("X", "Y", "Z")
+# float32 keeps ~7 significant digits; round on the way out so 0.3 reads back as 0.3
+COORD_DECIMALS = 5
+# Extension of compiled catalogs produced by `flask build-catalog` (see catalog_binary.py)
+BINARY_SUFFIX = ".bin"
+# Extensions of SQLite catalogs produced by `flask import-catalog` (see catalog_sqlite.py)
+SQLITE_SUFFIXES = (".db", ".sqlite")
+
+# Allergen list entries that mean "no allergens"
+NO_ALLERGENS = {"", "none"}
+# Compiled catalogs store per-product allergen masks as uint64
+MAX_ALLERGENS = 64
+MAX_ALLERGEN_LENGTH = 64
+
+
+class CatalogError(ValueError):
+    """Raised for a products.csv row that cannot be loaded."""
+
+
+# -----------------------------------------------------
+# ROW PARSING AND VALIDATION
+# -----------------------------------------------------
+
+def parse_point(text):
+    """Parses an "(a, b, c)" coordinate string into three finite floats."""
+    inner = text.strip()
+    if inner.startswith("(") and inner.endswith(")"):
+        inner = inner[1:-1]
+    parts = inner.split(",")
+    if len(parts) != 3:
+        raise CatalogError(f"expected 3 values, got {text!r}")
+    try:
+        values = [float(part) for part in parts]
+    except ValueError:
+        raise CatalogError(f"non-numeric coordinate in {text!r}") from None
+    if not all(math.isfinite(v) for v in values):
+        raise CatalogError(f"non-finite coordinate in {text!r}")
+    return values
+
+
+def parse_row(row):
+    """Validates one CSV row. Returns (name, barcode, 9 coordinate floats, allergens)."""
+    name = (row.get("Name") or "").strip()
+    if not name:
+        raise CatalogError("missing product name")
+    values = []
+    for column in COORD_COLUMNS:
+        if not row.get(column):
+            raise CatalogError(f"missing {column} coordinate")
+        values.extend(parse_point(row[column]))
+    # The shipped CSV calls the column "Allergy"; older exports used "Allergens"
+    allergens = (row.get("Allergens") or row.get("Allergy") or "None").replace(";", ",")
+    for allergen in split_allergens(allergens):
+        if not any(ch.isalpha() for ch in allergen) or len(allergen) > MAX_ALLERGEN_LENGTH:
+            raise CatalogError(f"invalid allergen {allergen!r}")
+    return name, (row.get("Barcode") or "").strip(), values, allergens
+
+
+# -----------------------------------------------------
+# ALLERGENS
+# -----------------------------------------------------
+
+def split_allergens(raw):
+    """Splits an allergen list ("Milk (Dairy), Wheat") into its names, dropping "None"."""
+    return [a.strip() for a in (raw or "").split(",") if a.strip().lower() not in NO_ALLERGENS]
+
+
+class AllergenRegistry:
+    """Process-wide allergen -> bit assignments.
+
+    Every loaded catalog holds the bits its products use (see hold()), and
+    a bit is never reassigned while any catalog still holds it, so masks
+    stay valid across catalog reloads and between the parsed and compiled
+    catalog backends. Bits no catalog holds any more are handed to new
+    allergens first, so renamed or removed allergens do not pile up.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bits = {}
+        self._names = []
+        # bit -> number of catalogs holding it
+        self._holders = []
+
+    def __len__(self):
+        return len(self._bits)
+
+    def hold(self, name, held):
+        """Returns the bit for an allergen on behalf of a catalog, assigning one if it is new.
+
+        `held` is the catalog's set of held bits; the bit is added to it and
+        kept until release(held).
+        """
+        key = name.strip().lower()
+        with self._lock:
+            bit = self._bits.get(key)
+            if bit is None:
+                bit = self._free_bit()
+                self._names[bit] = name.strip()
+                self._bits[key] = bit
+            if bit not in held:
+                held.add(bit)
+                self._holders[bit] += 1
+        return bit
+
+    def _free_bit(self):
+        for bit, holders in enumerate(self._holders):
+            if not holders:
+                # No loaded catalog contains this allergen any more
+                self._bits.pop(self._names[bit].lower(), None)
+                return bit
+        self._names.append(None)
+        self._holders.append(0)
+        return len(self._names) - 1
+
+    def release(self, held):
+        """Drops a catalog's hold on its bits (called when the catalog is garbage collected)."""
+        with self._lock:
+            for bit in held:
+                self._holders[bit] -= 1
+            held.clear()
+
+    def mask(self, names):
+        """ORs together the bits of the given allergen names.
+
+        Unknown names are ignored: no product can contain an allergen the
+        registry has never seen.
+        """
+        mask = 0
+        for name in names:
+            bit = self._bits.get(name.strip().lower())
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+    def names(self, mask):
+        """Display names of the allergens set in a mask."""
+        return [name for bit, name in enumerate(self._names) if mask >> bit & 1]
+
+
+ALLERGENS = AllergenRegistry()
+
+# Set-bit positions of every byte value, for walking product bitsets
+_BYTE_BITS = [tuple(b for b in range(8) if value >> b & 1) for value in range(256)]
+
+
+def bitset_ids(bitset, count, limit=None):
+    """Product ids whose bit is set in a bitset integer over `count` products, in id order."""
+    ids = []
+    for index, byte in enumerate(bitset.to_bytes((count + 7) // 8, "little")):
+        if byte:
+            base = index * 8
+            ids.extend(base + b for b in _BYTE_BITS[byte])
+            if limit is not None and len(ids) >= limit:
+                return ids[:limit]
+    return ids
+
+
+def bitset_from_ids(ids, count):
+    """Builds a bitset integer with the given product id bits set."""
+    data = bytearray((count + 7) // 8)
+    for product_id in ids:
+        data[product_id >> 3] |= 1 << (product_id & 7)
+    return int.from_bytes(data, "little")
+
+
+# -----------------------------------------------------
+# COLUMN STORE
+# -----------------------------------------------------
+
+def coordinates_record(values):
+    """Builds the Coordinates record from 9 stored floats (X, Y, Z points), rounded to COORD_DECIMALS."""
+    v = [round(value, COORD_DECIMALS) for value in values]
+    return Coordinates(Point(*v[0:3]), Point(*v[3:6]), Point(*v[6:9]))
+
+
+class CoordinateStore:
+    """All product coordinates in one contiguous float32 array, 9 values (X, Y, Z points) per product."""
+
+    def __init__(self):
+        self._values = array("f")
+
+    def __len__(self):
+        return len(self._values) // 9
+
+    def append(self, values):
+        self._values.extend(values)
+
+    def view(self):
+        """Zero-copy (n, 3, 3) view of the whole store."""
+        if not self._values:
+            # memoryview cannot cast to a shape containing 0
+            return memoryview(self._values)
+        return memoryview(self._values).cast("B").cast("f", (len(self), 3, 3))
+
+    def get(self, product_id):
+        """Returns the Coordinates record for one product."""
+        start = product_id * 9
+        return coordinates_record(self._values[start:start + 9])
+
+
+class CatalogData:
+    """Immutable column store and lookup tables for one version of the catalog."""
+
+    def __init__(self):
+        self.names = []
+        self.barcodes = []
+        self.allergens = []
+        self.allergen_masks = array("Q")
+        # allergen bit -> bitset of every product containing it (filled in by finish())
+        self.allergen_products = {}
+        self._allergen_ids = {}
+        # ALLERGENS bits this version uses, released once it is no longer referenced
+        self._held_bits = set()
+        weakref.finalize(self, ALLERGENS.release, self._held_bits)
+        self.coords = CoordinateStore()
+        self.by_name = {}
+        self.by_barcode = {}
+        self.rejected = 0
+        self.search_index = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, barcode, coord_values, allergens):
+        mask = 0
+        for allergen in split_allergens(allergens):
+            mask |= 1 << ALLERGENS.hold(allergen, self._held_bits)
+        if mask >> 64 and isinstance(self.allergen_masks, array):
+            # More than 64 allergens in use across loaded catalogs: fall back to unbounded ints
+            self.allergen_masks = list(self.allergen_masks)
+        product_id = len(self.names)
+        self.names.append(name)
+        self.barcodes.append(barcode)
+        self.allergens.append(allergens)
+        self.allergen_masks.append(mask)
+        self.coords.append(coord_values)
+        bit = 0
+        while mask:
+            if mask & 1:
+                self._allergen_ids.setdefault(bit, []).append(product_id)
+            mask >>= 1
+            bit += 1
+        # First row wins, matching the old linear scan
+        self.by_name.setdefault(name.lower(), product_id)
+        if barcode:
+            self.by_barcode.setdefault(barcode, product_id)
+
+    def finish(self):
+        self.search_index = NameSearchIndex(self.names)
+        self.allergen_products = {
+            bit: bitset_from_ids(ids, len(self)) for bit, ids in self._allergen_ids.items()
+        }
+        self._allergen_ids = {}
+        return self
+
+    def snapshot(self):
+        """Context for lookups that must see one catalog state; this version never changes."""
+        return nullcontext()
+
+    def find_name_id(self, key):
+        return self.by_name.get(key)
+
+    def find_barcode_id(self, barcode):
+        return self.by_barcode.get(barcode)
+
+    def iter_barcodes(self):
+        return iter(self.barcodes)
+
+    def coordinates(self):
+        return self.coords.view()
+
+    def search(self, query, limit):
+        return self.search_index.search(query, limit)
+
+    def safe_ids(self, user_mask, limit=None):
+        """Ids of every product sharing no allergen with user_mask, in catalog order."""
+        unsafe = 0
+        for bit, products in self.allergen_products.items():
+            if user_mask >> bit & 1:
+                unsafe |= products
+        every = (1 << len(self)) - 1
+        return bitset_ids(every & ~unsafe, len(self), limit)
+
+    def product(self, product_id):
+        """Builds the lightweight record for one product id."""
+        return Product(
+            product_id,
+            self.names[product_id],
+            self.barcodes[product_id],
+            self.coords.get(product_id),
+            self.allergens[product_id],
+            self.allergen_masks[product_id],
+        )
+
+
+def read_source_rows(source_file):
+    """Yields (line number, row dict) from products.csv or products.xlsx."""
+    if source_file.lower().endswith(".xlsx"):
+        from xlsx_import import read_workbook_rows
+        yield from read_workbook_rows(source_file)
+        return
+
+    with open(source_file, newline='', encoding='utf-8') as f:
+        yield from enumerate(csv.DictReader(f), start=2)
+
+
+def iter_products(source_file, rejected=None):
+    """Yields validated (name, barcode, coords, allergens) rows.
+
+    Malformed rows are reported and skipped; their line numbers are appended
+    to `rejected` when a list is given.
+    """
+    for line_no, row in read_source_rows(source_file):
+        try:
+            yield parse_row(row)
+        except CatalogError as e:
+            print(f"ERROR: Rejected {os.path.basename(source_file)} line {line_no}: {e}")
+            if rejected is not None:
+                rejected.append(line_no)
+
+
+def load_catalog(csv_file):
+    """Reads and validates products.csv into an in-memory CatalogData."""
+    data = CatalogData()
+    rejected = []
+    for fields in iter_products(csv_file, rejected):
+        data.add(*fields)
+    data.rejected = len(rejected)
+    return data.finish()
+
+
+def loader_for(catalog_file):
+    """Picks the loader for a catalog file.
+
+    Compiled binary catalogs are mmapped, SQLite catalogs are queried in
+    place, anything else is parsed into memory.
+    """
+    if catalog_file.endswith(BINARY_SUFFIX):
+        from catalog_binary import open_binary_catalog
+        return open_binary_catalog
+    if catalog_file.endswith(SQLITE_SUFFIXES):
+        from catalog_sqlite import open_sqlite_catalog
+        return open_sqlite_catalog
+    return load_catalog
+
+
+# -----------------------------------------------------
+# CATALOG
+# -----------------------------------------------------
+
+class ProductCatalog:
+    """Holds the product catalog in memory with hash indexes on name and barcode.
+
+    The source file (products.csv, a compiled .bin catalog which is mmapped
+    instead of parsed, or a SQLite database) is re-read when its mtime changes. A reload
+    builds a complete new set of indexes and swaps it in with a single
+    assignment, so lookups never see a half-built catalog.
+    """
+
+    def __init__(self, csv_file, check_interval=RELOAD_CHECK_SECONDS):
+        self.csv_file = csv_file
+        self.check_interval = check_interval
+        self._loader = loader_for(csv_file)
+        self.version = 0
+        self._reload_lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0.0
+        self._data = CatalogData().finish()
+        self.reload()
+
+    def __len__(self):
+        return len(self._data)
+
+    def reload(self):
+        """Re-reads the CSV. On failure the previous catalog stays in service."""
+        with self._reload_lock:
+            return self._load()
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.csv_file).st_mtime_ns
+            data = self._loader(self.csv_file)
+        except FileNotFoundError:
+            print(f"ERROR: Catalog file not found at {self.csv_file}")
+            return False
+        except Exception as e:
+            print(f"ERROR: Could not load catalog from {self.csv_file}: {e}")
+            return False
+
+        self._data = data
+        self._mtime = mtime
+        self.version += 1
+        print(f"--- Catalog v{self.version} loaded: {len(data)} products, {data.rejected} rejected ---")
+        return True
+
+    def refresh(self):
+        """Reloads the catalog if the CSV changed. Stats the file at most once per interval.
+
+        Never waits for a reload: while another thread is loading, the
+        previous catalog keeps answering.
+        """
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            # Stat under the lock, so a change another thread has just loaded is not loaded again
+            try:
+                mtime = os.stat(self.csv_file).st_mtime_ns
+            except OSError:
+                return
+            if mtime != self._mtime:
+                self._load()
+        finally:
+            self._reload_lock.release()
+
+    def current_version(self):
+        """The catalog version after picking up any change to the source file."""
+        self.refresh()
+        return self.version
+
+    def barcodes(self):
+        """Every barcode in the current catalog version, in catalog order."""
+        self.refresh()
+        return self._data.iter_barcodes()
+
+    def coordinates(self):
+        """Zero-copy (n, 3, 3) float32 view of every product's coordinates, indexed by product id."""
+        self.refresh()
+        return self._data.coordinates()
+
+    def find_by_name(self, product_name):
+        """Case-insensitive exact name lookup. Returns a Product or None."""
+        self.refresh()
+        if not product_name:
+            return None
+        data = self._data
+        with data.snapshot():
+            product_id = data.find_name_id(product_name.strip().lower())
+            return None if product_id is None else data.product(product_id)
+
+    def find_by_barcode(self, barcode_data):
+        """Exact barcode lookup. Returns a Product or None."""
+        self.refresh()
+        if not barcode_data:
+            return None
+        data = self._data
+        with data.snapshot():
+            product_id = data.find_barcode_id(barcode_data.strip())
+            return None if product_id is None else data.product(product_id)
+
+    def lookup_many(self, barcodes=(), names=()):
+        """Resolves many barcodes and names against a single catalog version.
+
+        Returns (barcode matches, name matches): lists of Product or None,
+        in the order given.
+        """
+        self.refresh()
+        data = self._data
+
+        def resolve(product_id):
+            return None if product_id is None else data.product(product_id)
+
+        with data.snapshot():
+            by_barcode = [resolve(data.find_barcode_id(code.strip())) if code else None for code in barcodes]
+            by_name = [resolve(data.find_name_id(name.strip().lower())) if name else None for name in names]
+        return by_barcode, by_name
+
+    def search(self, query, limit=5):
+        """Typo-tolerant name search. Returns up to `limit` (Product, score) pairs, best first."""
+        self.refresh()
+        data = self._data
+        with data.snapshot():
+            found = [(data.product(i), score) for i, score in data.search(query, limit)]
+        # A SQLite catalog's name index can name products deleted since it was built
+        return [(product, score) for product, score in found if product is not None]
+
+    def safe_products(self, user_mask, limit=None):
+        """Every product (up to `limit`) that is safe for the allergies in user_mask.
+
+        The whole catalog is filtered with a few big-integer operations over
+        per-allergen product bitsets rather than a per-product loop.
+        """
+        self.refresh()
+        data = self._data
+        with data.snapshot():
+            return [data.product(i) for i in data.safe_ids(user_mask, limit)]
+
+    def safe_alternatives(self, product, user_mask, limit=3):
+        """Products with names similar to `product` that are safe for user_mask."""
+        # Search on the descriptive words only, so "Hovis Bread 800g" also finds other sizes and brands
+        words = [word for word in product.name.split() if not any(ch.isdigit() for ch in word)]
+        alternatives = []
+        for candidate, _score in self.search(" ".join(words) or product.name, limit=25):
+            if candidate.id != product.id and not candidate.allergen_mask & user_mask:
+                alternatives.append(candidate)
+                if len(alternatives) >= limit:
+                    break
+        return alternatives
@@ -0,0 +1,359 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+import weakref
+import zlib
+from array import array
+from contextlib import nullcontext
+
+from catalog import (
+    ALLERGENS,
+    MAX_ALLERGENS,
+    Product,
+    bitset_from_ids,
+    bitset_ids,
+    coordinates_record,
+    iter_products,
+    split_allergens,
+)
+from search_index import NameSearchIndex
+
+# -----------------------------------------------------
+# FILE LAYOUT (all little-endian)
+# -----------------------------------------------------
+# header       magic, format version, product count, section offsets, name table size
+# coords       count x 9 float32               (X, Y, Z points; viewable as (n, 3, 3))
+# records      count x fixed-width record      (string pool offset/length of name, barcode, allergens)
+# barcodes     count x uint32 product id       (sorted by barcode bytes, binary searched)
+# names        slots x uint32 product id + 1   (open-addressing hash table on crc32 of the lowercased name, 0 = empty)
+# allergens    allergen count x (string pool offset, length) of the allergen name
+# masks        count x uint64 allergen mask    (bit i = allergen i of the file's allergen table)
+# bitsets      allergen count x ceil(count / 8) bytes, product bitset of each allergen
+# strings      UTF-8 string pool
+# search       NameSearchIndex arrays (see SEARCH_ARRAYS), so workers never rebuild it:
+#              SEARCH header, vocabulary (newline-separated), then each array, 4-byte aligned
+
+MAGIC = b"PEPCAT\x00\x01"
+FORMAT_VERSION = 3
+HEADER = struct.Struct("<8sIIQQQQQIQQQIQ")
+RECORD = struct.Struct("<IHIHIH")
+ALLERGEN = struct.Struct("<IH")
+COORDS_SIZE = 9 * 4
+SLOT = struct.Struct("<I")
+# Vocabulary size in bytes, then the length in items of each of SEARCH_ARRAYS
+SEARCH = struct.Struct("<9I")
+SEARCH_ARRAYS = (("offsets", "I"), ("postings", "I"), ("slots", "i"), ("bitsets", "B"), ("order", "I"),
+                 ("lengths", "H"), ("exact_hashes", "I"), ("exact_ranks", "I"))
+
+
+def _name_hash(key_bytes):
+    # crc32 rather than hash(): it must be stable across processes and runs
+    return zlib.crc32(key_bytes)
+
+
+def _padded(data):
+    data = bytes(data)
+    return data + bytes(-len(data) % 4)
+
+
+def _search_section(names):
+    """The compiled NameSearchIndex for `names`, as bytes for the search section."""
+    words, arrays = NameSearchIndex(names).to_arrays()
+    vocabulary = "\n".join(words).encode("utf-8")
+    lengths = [len(arrays[key]) for key, _ in SEARCH_ARRAYS]
+    return SEARCH.pack(len(vocabulary), *lengths) + b"".join(
+        _padded(data) for data in [vocabulary] + [arrays[key] for key, _ in SEARCH_ARRAYS])
+
+
+# -----------------------------------------------------
+# BUILD
+# -----------------------------------------------------
+
+def build_catalog(source_file, output_file):
+    """Compiles products.csv/products.xlsx into a binary catalog. Returns (products written, rows rejected)."""
+    if sys.byteorder != "little":
+        # Tables are written and mapped in native order; the format is little-endian only
+        raise RuntimeError("binary catalogs can only be built on little-endian hosts")
+
+    coords = array("f")
+    records = []
+    names = []
+    strings = bytearray()
+    barcodes = []
+    first_by_name = {}
+    rejected = []
+    masks = array("Q")
+    allergen_bits = {}
+    allergen_names = []
+    allergen_ids = []
+
+    def intern(text):
+        data = text.encode("utf-8")
+        if len(data) > 0xFFFF:
+            data = data[:0xFFFF]
+        offset = len(strings)
+        strings.extend(data)
+        return offset, len(data)
+
+    for name, barcode, coord_values, allergens in iter_products(source_file, rejected):
+        product_id = len(records)
+        new_allergens = {a.lower() for a in split_allergens(allergens)} - allergen_bits.keys()
+        if len(allergen_names) + len(new_allergens) > MAX_ALLERGENS:
+            print(f"ERROR: Rejected {os.path.basename(source_file)} product {name!r}: "
+                  f"more than {MAX_ALLERGENS} distinct allergens")
+            rejected.append(name)
+            continue
+        mask = 0
+        for allergen in split_allergens(allergens):
+            key = allergen.lower()
+            if key not in allergen_bits:
+                allergen_bits[key] = len(allergen_names)
+                allergen_names.append(allergen)
+                allergen_ids.append([])
+            bit = allergen_bits[key]
+            if not mask >> bit & 1:
+                allergen_ids[bit].append(product_id)
+            mask |= 1 << bit
+        masks.append(mask)
+        coords.extend(coord_values)
+        records.append(intern(name) + intern(barcode) + intern(allergens))
+        names.append(name)
+        if barcode:
+            barcodes.append((barcode.encode("utf-8"), product_id))
+        # First row wins, matching ProductCatalog
+        first_by_name.setdefault(name.lower().encode("utf-8"), product_id)
+
+    count = len(records)
+
+    # Sorted barcode table; duplicates keep the earliest product id first
+    barcodes.sort()
+    unique_barcodes = []
+    for code, product_id in barcodes:
+        if not unique_barcodes or unique_barcodes[-1][0] != code:
+            unique_barcodes.append((code, product_id))
+    barcode_table = array("I", (product_id for _, product_id in unique_barcodes))
+
+    # Name hash table at <= 50% load
+    slots = 1
+    while slots < max(2 * len(first_by_name), 8):
+        slots *= 2
+    name_table = array("I", bytes(4 * slots))
+    for key, product_id in first_by_name.items():
+        slot = _name_hash(key) & (slots - 1)
+        while name_table[slot]:
+            slot = (slot + 1) & (slots - 1)
+        name_table[slot] = product_id + 1
+
+    allergen_table = [intern(allergen) for allergen in allergen_names]
+    bitset_size = (count + 7) // 8
+
+    coords_off = HEADER.size
+    records_off = coords_off + count * COORDS_SIZE
+    barcodes_off = records_off + count * RECORD.size
+    names_off = barcodes_off + len(barcode_table) * 4
+    allergens_off = names_off + slots * 4
+    masks_off = allergens_off + len(allergen_table) * ALLERGEN.size
+    bitsets_off = masks_off + count * 8
+    strings_off = bitsets_off + len(allergen_table) * bitset_size
+    search_off = strings_off + len(strings) + (-len(strings) % 4)
+    search = _search_section(names)
+
+    # Write to a temp file and rename, so running apps never mmap a half-written catalog
+    tmp_file = f"{output_file}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, count, coords_off, records_off,
+                            barcodes_off, names_off, strings_off, slots,
+                            allergens_off, masks_off, bitsets_off, len(allergen_table), search_off))
+        f.write(coords.tobytes())
+        for record in records:
+            f.write(RECORD.pack(*record))
+        f.write(barcode_table.tobytes())
+        f.write(name_table.tobytes())
+        for entry in allergen_table:
+            f.write(ALLERGEN.pack(*entry))
+        f.write(masks.tobytes())
+        for ids in allergen_ids:
+            f.write(bitset_from_ids(ids, count).to_bytes(bitset_size, "little"))
+        f.write(_padded(strings))
+        f.write(search)
+    os.replace(tmp_file, output_file)
+    return count, len(rejected)
+
+
+# -----------------------------------------------------
+# READ (mmap)
+# -----------------------------------------------------
+
+class BinaryCatalogData:
+    """Read-only view of a compiled catalog, backed by mmap.
+
+    Nothing is copied at open, so startup is instant and forked workers
+    share the same page cache. Provides the same lookups as catalog.CatalogData.
+    The name search index is read from the file too; the only per-process
+    cost is its trigram table over the vocabulary (distinct name words,
+    typically a few thousand), built at open in milliseconds.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self._count, self._coords_off, self._records_off,
+         self._barcodes_off, self._names_off, self._strings_off, self._slots,
+         allergens_off, self._masks_off, bitsets_off, allergen_count, search_off) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} product catalog; rebuild it with build-catalog")
+        self._barcode_count = (self._names_off - self._barcodes_off) // 4
+        self.rejected = 0
+        self._search_index = self._open_search_index(search_off)
+
+        # Translate the file's allergen bits to the process-wide registry bits.
+        # In a process that only opens compiled catalogs these are the same.
+        bitset_size = (self._count + 7) // 8
+        self._file_bits = []
+        self.allergen_products = {}
+        self._held_bits = set()
+        weakref.finalize(self, ALLERGENS.release, self._held_bits)
+        for i in range(allergen_count):
+            name = self._string(*ALLERGEN.unpack_from(self._mm, allergens_off + i * ALLERGEN.size))
+            bit = ALLERGENS.hold(name, self._held_bits)
+            self._file_bits.append(bit)
+            start = bitsets_off + i * bitset_size
+            self.allergen_products[bit] = int.from_bytes(self._mm[start:start + bitset_size], "little")
+        self._identity_bits = self._file_bits == list(range(allergen_count))
+
+    def __len__(self):
+        return self._count
+
+    def _open_search_index(self, offset):
+        vocabulary_size, *lengths = SEARCH.unpack_from(self._mm, offset)
+        view = memoryview(self._mm)
+        offset += SEARCH.size
+        words = bytes(view[offset:offset + vocabulary_size]).decode("utf-8")
+        offset += vocabulary_size + (-vocabulary_size % 4)
+        arrays = {}
+        for (key, typecode), length in zip(SEARCH_ARRAYS, lengths):
+            size = length * struct.calcsize(typecode)
+            arrays[key] = view[offset:offset + size].cast(typecode)
+            offset += size + (-size % 4)
+        return NameSearchIndex.from_arrays(_NameColumn(self), words.split("\n") if words else [], arrays)
+
+    def _string(self, offset, length):
+        start = self._strings_off + offset
+        return self._mm[start:start + length].decode("utf-8")
+
+    def _record(self, product_id):
+        return RECORD.unpack_from(self._mm, self._records_off + product_id * RECORD.size)
+
+    def _name(self, product_id):
+        name_off, name_len = self._record(product_id)[:2]
+        return self._string(name_off, name_len)
+
+    def _barcode_bytes(self, product_id):
+        _, _, code_off, code_len, _, _ = self._record(product_id)
+        start = self._strings_off + code_off
+        return self._mm[start:start + code_len]
+
+    def snapshot(self):
+        return nullcontext()
+
+    def find_name_id(self, key):
+        key_bytes = key.encode("utf-8")
+        mask = self._slots - 1
+        slot = _name_hash(key_bytes) & mask
+        while True:
+            (entry,) = SLOT.unpack_from(self._mm, self._names_off + slot * 4)
+            if not entry:
+                return None
+            if self._name(entry - 1).lower() == key:
+                return entry - 1
+            slot = (slot + 1) & mask
+
+    def find_barcode_id(self, barcode):
+        target = barcode.encode("utf-8")
+        lo, hi = 0, self._barcode_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (product_id,) = SLOT.unpack_from(self._mm, self._barcodes_off + mid * 4)
+            code = self._barcode_bytes(product_id)
+            if code == target:
+                return product_id
+            if code < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def iter_barcodes(self):
+        for product_id in range(self._count):
+            yield self._barcode_bytes(product_id).decode("utf-8")
+
+    def coordinates(self):
+        if not self._count:
+            return memoryview(b"").cast("f")
+        view = memoryview(self._mm)[self._coords_off:self._coords_off + self._count * COORDS_SIZE]
+        return view.cast("f", (self._count, 3, 3))
+
+    def search(self, query, limit):
+        return self._search_index.search(query, limit)
+
+    def _mask(self, product_id):
+        (file_mask,) = struct.unpack_from("<Q", self._mm, self._masks_off + product_id * 8)
+        if self._identity_bits:
+            return file_mask
+        mask = 0
+        for i, bit in enumerate(self._file_bits):
+            if file_mask >> i & 1:
+                mask |= 1 << bit
+        return mask
+
+    def safe_ids(self, user_mask, limit=None):
+        unsafe = 0
+        for bit, products in self.allergen_products.items():
+            if user_mask >> bit & 1:
+                unsafe |= products
+        every = (1 << self._count) - 1
+        return bitset_ids(every & ~unsafe, self._count, limit)
+
+    def product(self, product_id):
+        name_off, name_len, code_off, code_len, allergen_off, allergen_len = self._record(product_id)
+        return Product(
+            product_id,
+            self._string(name_off, name_len),
+            self._string(code_off, code_len),
+            coordinates_record(struct.unpack_from("<9f", self._mm, self._coords_off + product_id * COORDS_SIZE)),
+            self._string(allergen_off, allergen_len),
+            self._mask(product_id),
+        )
+
+
+class _NameColumn:
+    """Product names read from the mapped file on demand (the search index checks exact matches with them)."""
+
+    def __init__(self, data):
+        self._data = data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, product_id):
+        return self._data._name(product_id)
+
+
+def open_binary_catalog(path):
+    """Catalog loader for ProductCatalog: maps a compiled catalog file."""
+    return BinaryCatalogData(path)
+
+
+# -----------------------------------------------------
+# COMMAND LINE (also available as `flask --app app2 build-catalog`)
+# -----------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compile products.csv/products.xlsx into a binary catalog.")
+    parser.add_argument("source", nargs="?", default="database/products.csv")
+    parser.add_argument("output", nargs="?", default="database/products.bin")
+    args = parser.parse_args()
+
+    written, skipped = build_catalog(args.source, args.output)
+    print(f"--- Wrote {written} products to {args.output} ({skipped} rejected) ---")
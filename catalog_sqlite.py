@@ -0,0 +1,383 @@
+import argparse
+import os
+import queue
+import sqlite3
+import struct
+import threading
+import weakref
+from array import array
+from contextlib import contextmanager
+
+from catalog import (
+    ALLERGENS,
+    CatalogError,
+    Product,
+    coordinates_record,
+    iter_products,
+    parse_row,
+    split_allergens,
+)
+from search_index import NameSearchIndex, normalize
+
+# -----------------------------------------------------
+# SCHEMA
+# -----------------------------------------------------
+# Coordinates are a 36-byte BLOB of 9 float32 (X, Y, Z points), like the other backends.
+# allergen_mask uses this file's own bit numbering (the allergens table), which an
+# import may renumber, so it is only used inside SQL, together with an allergens
+# table read in the same transaction. Products read back get their ALLERGENS mask
+# from the row's allergen names. AUTOINCREMENT keeps an import from reusing the
+# ids of the products it replaces.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    barcode TEXT NOT NULL DEFAULT '',
+    coords BLOB NOT NULL,
+    allergens TEXT NOT NULL DEFAULT 'None',
+    allergen_mask INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS products_barcode ON products (barcode);
+CREATE INDEX IF NOT EXISTS products_name_key ON products (name_key);
+
+CREATE TABLE IF NOT EXISTS allergens (
+    bit INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5 (
+    name, content='products', content_rowid='id', prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS products_ai AFTER INSERT ON products BEGIN
+    INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS products_ad AFTER DELETE ON products BEGIN
+    INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS products_au AFTER UPDATE ON products BEGIN
+    INSERT INTO products_fts (products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    INSERT INTO products_fts (rowid, name) VALUES (new.id, new.name);
+END;
+"""
+
+COORDS = struct.Struct("<9f")
+MAX_SQL_BITS = 63  # SQLite integers are signed 64-bit
+# Idle read-only connections kept open per catalog version; busier moments open more, then close them
+MAX_IDLE_CONNECTIONS = 8
+
+
+def _connect_writer(db_file):
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    # WAL lets lookups keep reading while an import or edit is being written
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _file_mask(conn, bits, allergens):
+    """Mask of an allergen list in this database's bit numbering, adding new allergens to its table.
+
+    `bits` caches the allergens table (key -> bit) for the current transaction.
+    """
+    mask = 0
+    for allergen in split_allergens(allergens):
+        key = allergen.lower()
+        bit = bits.get(key)
+        if bit is None:
+            if len(bits) >= MAX_SQL_BITS:
+                raise CatalogError(f"more than {MAX_SQL_BITS} distinct allergens")
+            bit = bits[key] = len(bits)
+            conn.execute("INSERT INTO allergens (bit, key, name) VALUES (?, ?, ?)", (bit, key, allergen))
+        mask |= 1 << bit
+    return mask
+
+
+def _product_params(conn, bits, name, barcode, coord_values, allergens):
+    return (name, name.lower(), barcode, COORDS.pack(*coord_values), allergens, _file_mask(conn, bits, allergens))
+
+
+def _import_params(conn, bits, source_file, rejected):
+    for fields in iter_products(source_file, rejected):
+        try:
+            yield _product_params(conn, bits, *fields)
+        except CatalogError as e:
+            print(f"ERROR: Rejected {os.path.basename(source_file)} product {fields[0]!r}: {e}")
+            rejected.append(fields[0])
+
+
+def _touch(db_file):
+    # Committed WAL writes do not change the main file's mtime; bump it so
+    # ProductCatalog notices the edit and moves to a new catalog version.
+    os.utime(db_file, None)
+
+
+# -----------------------------------------------------
+# IMPORT AND EDITS
+# -----------------------------------------------------
+
+def import_catalog(source_file, db_file):
+    """Replaces the database contents with products.csv/products.xlsx in one transaction.
+
+    Lookups running meanwhile see either the old or the new catalog, never a
+    mix. Returns (products written, rows rejected).
+    """
+    rejected = []
+    conn = _connect_writer(db_file)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM products")
+            conn.execute("DELETE FROM allergens")
+            bits = {}
+            conn.executemany(
+                "INSERT INTO products (name, name_key, barcode, coords, allergens, allergen_mask) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                _import_params(conn, bits, source_file, rejected),
+            )
+            (written,) = conn.execute("SELECT COUNT(*) FROM products").fetchone()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    _touch(db_file)
+    return written, len(rejected)
+
+
+def upsert_product(db_file, row):
+    """Adds or updates one product (a products.csv-style row dict), matched by barcode, else by name."""
+    name, barcode, coord_values, allergens = parse_row(row)
+    conn = _connect_writer(db_file)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            bits = dict(conn.execute("SELECT key, bit FROM allergens"))
+            params = _product_params(conn, bits, name, barcode, coord_values, allergens)
+            if barcode:
+                existing = conn.execute("SELECT id FROM products WHERE barcode = ? ORDER BY id", (barcode,)).fetchone()
+            else:
+                existing = conn.execute("SELECT id FROM products WHERE name_key = ? ORDER BY id", (params[1],)).fetchone()
+            if existing:
+                conn.execute(
+                    "UPDATE products SET name = ?, name_key = ?, barcode = ?, coords = ?, allergens = ?, "
+                    "allergen_mask = ? WHERE id = ?",
+                    params + existing,
+                )
+            else:
+                conn.execute(
+                    "INSERT INTO products (name, name_key, barcode, coords, allergens, allergen_mask) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    params,
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    _touch(db_file)
+
+
+def delete_product(db_file, barcode):
+    """Removes every product with the given barcode. Returns how many were removed."""
+    conn = _connect_writer(db_file)
+    try:
+        removed = conn.execute("DELETE FROM products WHERE barcode = ?", (barcode,)).rowcount
+    finally:
+        conn.close()
+    _touch(db_file)
+    return removed
+
+
+# -----------------------------------------------------
+# READ (thread-local pooled connections)
+# -----------------------------------------------------
+
+class SQLiteCatalogData:
+    """Catalog lookups answered by SQLite.
+
+    Read-only connections are kept in a pool: a lookup checks one out and
+    returns it afterwards, so request threads (a new one per request under
+    Flask's threaded server) reuse connections instead of opening their own.
+    Provides the same lookups as catalog.CatalogData. Product ids are the
+    table's rowids. The database can change under an open instance (imports
+    and edits are picked up at the next reload), so lookups that take
+    several statements run inside snapshot().
+    """
+
+    def __init__(self, db_file):
+        if not os.path.exists(db_file):
+            raise FileNotFoundError(db_file)
+        self.db_file = db_file
+        self.rejected = 0
+        self._pool = queue.LifoQueue(maxsize=MAX_IDLE_CONNECTIONS)
+        # The connection of the snapshot() open on this thread, if any
+        self._local = threading.local()
+
+        self._held_bits = set()
+        weakref.finalize(self, ALLERGENS.release, self._held_bits)
+        with self.snapshot(), self._reading() as conn:
+            self._count = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+            # Register every allergen in the file so user masks can name them
+            for (name,) in conn.execute("SELECT name FROM allergens"):
+                ALLERGENS.hold(name, self._held_bits)
+            # FTS5 is not typo-tolerant; the trigram index it falls back to is built here, in the
+            # reload, rather than by the first request with a typo
+            rows = conn.execute("SELECT id, name FROM products ORDER BY id").fetchall()
+        self._index_ids = array("I", (product_id for product_id, _ in rows))
+        self._search_index = NameSearchIndex([name for _, name in rows])
+
+    def __len__(self):
+        return self._count
+
+    def _open(self):
+        conn = sqlite3.connect(f"file:{self.db_file}?mode=ro", uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def _checkout(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._open()
+
+    def _return(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @contextmanager
+    def _reading(self):
+        """A connection for one lookup: this thread's snapshot connection, else one from the pool."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._return(conn)
+
+    @contextmanager
+    def snapshot(self):
+        """Runs the enclosed lookups in one read transaction, so they all see the same database state."""
+        if getattr(self._local, "conn", None) is not None:
+            yield
+            return
+        conn = self._checkout()
+        self._local.conn = conn
+        try:
+            conn.execute("BEGIN")
+            try:
+                yield
+            finally:
+                conn.execute("COMMIT")
+        finally:
+            self._local.conn = None
+            self._return(conn)
+
+    def _mask(self, allergens):
+        mask = 0
+        for allergen in split_allergens(allergens):
+            mask |= 1 << ALLERGENS.hold(allergen, self._held_bits)
+        return mask
+
+    def _to_file_mask(self, conn, user_mask):
+        """User mask in the file's current bit numbering; call inside the transaction that uses it."""
+        keys = {name.lower() for name in ALLERGENS.names(user_mask)}
+        file_mask = 0
+        for bit, key in conn.execute("SELECT bit, key FROM allergens"):
+            if key in keys:
+                file_mask |= 1 << bit
+        return file_mask
+
+    def find_name_id(self, key):
+        with self._reading() as conn:
+            row = conn.execute("SELECT id FROM products WHERE name_key = ? ORDER BY id LIMIT 1", (key,)).fetchone()
+        return row[0] if row else None
+
+    def find_barcode_id(self, barcode):
+        with self._reading() as conn:
+            row = conn.execute("SELECT id FROM products WHERE barcode = ? ORDER BY id LIMIT 1", (barcode,)).fetchone()
+        return row[0] if row else None
+
+    def iter_barcodes(self):
+        with self._reading() as conn:
+            rows = conn.execute("SELECT barcode FROM products ORDER BY id").fetchall()
+        return (barcode for (barcode,) in rows)
+
+    def coordinates(self):
+        # Rows are laid out by rowid; ids without a product (id 0, deleted rows) stay zero
+        with self._reading() as conn:
+            rows = conn.execute("SELECT id, coords FROM products ORDER BY id").fetchall()
+        size = rows[-1][0] + 1 if rows else 0
+        values = array("f", bytes(size * COORDS.size))
+        for product_id, blob in rows:
+            values[product_id * 9:product_id * 9 + 9] = array("f", blob)
+        if not size:
+            return memoryview(values)
+        return memoryview(values).cast("B").cast("f", (size, 3, 3))
+
+    def search(self, query, limit):
+        words = normalize(query or "").split()
+        if words:
+            # Every word as a prefix, ranked by FTS5's bm25
+            match = " AND ".join(f'"{word}"*' for word in words)
+            with self._reading() as conn:
+                rows = conn.execute(
+                    "SELECT rowid FROM products_fts WHERE products_fts MATCH ? ORDER BY rank LIMIT ?", (match, limit)
+                ).fetchall()
+            if rows:
+                return [(product_id, 0.9 - 0.01 * i) for i, (product_id,) in enumerate(rows)]
+
+        # Not found by FTS5 (e.g. a typo): the trigram index built at open
+        return [(self._index_ids[i], score) for i, score in self._search_index.search(query, limit)]
+
+    def safe_ids(self, user_mask, limit=None):
+        with self.snapshot(), self._reading() as conn:
+            rows = conn.execute(
+                "SELECT id FROM products WHERE allergen_mask & ? = 0 ORDER BY id LIMIT ?",
+                (self._to_file_mask(conn, user_mask), -1 if limit is None else limit),
+            )
+            return [product_id for (product_id,) in rows]
+
+    def product(self, product_id):
+        with self._reading() as conn:
+            row = conn.execute(
+                "SELECT name, barcode, coords, allergens FROM products WHERE id = ?", (product_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        name, barcode, blob, allergens = row
+        return Product(
+            product_id,
+            name,
+            barcode,
+            coordinates_record(COORDS.unpack(blob)),
+            allergens,
+            self._mask(allergens),
+        )
+
+
+def open_sqlite_catalog(db_file):
+    """Catalog loader for ProductCatalog: opens a catalog database."""
+    return SQLiteCatalogData(db_file)
+
+
+# -----------------------------------------------------
+# COMMAND LINE (also available as `flask --app app2 import-catalog`)
+# -----------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import products.csv/products.xlsx into a SQLite catalog.")
+    parser.add_argument("source", nargs="?", default="database/products.csv")
+    parser.add_argument("output", nargs="?", default="database/products.db")
+    args = parser.parse_args()
+
+    written, skipped = import_catalog(args.source, args.output)
+    print(f"--- Imported {written} products into {args.output} ({skipped} rejected) ---")
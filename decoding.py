@@ -0,0 +1,454 @@
+import io
+import multiprocessing
+import os
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageFilter
+from pyzbar.pyzbar import decode, ZBarSymbol
+
+from motion import dhash, hamming
+
+# --- One barcode read from a frame ---
+DecodeResult = namedtuple("DecodeResult", ["symbology", "data"])
+
+# Symbologies the kiosk scans for
+DEFAULT_SYMBOLS = [ZBarSymbol.QRCODE, ZBarSymbol.EAN13, ZBarSymbol.CODE128]
+
+# Most specific first: the order a symbology set derived from the catalog is listed in
+SYMBOLOGY_PREFERENCE = ["EAN13", "EAN8", "UPCA", "CODE128", "QRCODE"]
+# Longest payload treated as a linear barcode; anything longer must be a QR code
+MAX_LINEAR_LENGTH = 48
+
+# --- Preprocessing defaults ---
+# First pass decodes a copy at most this wide (SVGA 800px frames decode at half size)
+DOWNSCALE_WIDTH = 400
+# Edge strength (0-255) that counts as a bar edge, and the share of edge pixels
+# (0-255 after blurring) that marks a barcode-like region
+EDGE_THRESHOLD = 64
+DENSITY_THRESHOLD = 96
+DENSITY_RADIUS = 4
+# Dense pixels are grouped into regions on a grid of cells this many pixels wide; cells
+# up to REGION_GAP cells apart join one region (a downscaled barcode can have gaps)
+DENSITY_CELL = 8
+REGION_GAP = 2
+# Extra border around a detected region for the full-resolution retry, as a fraction of its size
+REGION_MARGIN = 0.15
+# Largest share of the (downscaled) frame the retry may cover; bigger regions are
+# cut down around their densest cell
+MAX_REGION_FRACTION = 0.25
+
+# --- Duplicate-frame skipping ---
+# A frame whose difference hash is within this many bits (of 64) of the last frame that
+# decoded to nothing is assumed to hold nothing either, and is not decoded
+DEDUP_MAX_DISTANCE = 1
+# Decode anyway after this many skips in a row, in case a barcode sits still but was missed
+DEDUP_MAX_SKIPS = 10
+
+# --- Decode backends ---
+# "thread" decodes in the caller's thread (the default); "process" in a ProcessDecodePool
+DECODE_BACKENDS = ("thread", "process")
+# Frames a process pool accepts per worker before submitters wait
+PENDING_PER_WORKER = 2
+
+
+def _gtin_check_ok(digits):
+    """True when the last digit is the GS1 check digit (EAN-13, EAN-8, UPC-A)."""
+    body, check = digits[:-1], int(digits[-1])
+    total = sum(int(d) * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(body)))
+    return (10 - total % 10) % 10 == check
+
+
+def barcode_symbology(code):
+    """The symbology a catalog barcode would be printed in, by its shape."""
+    if code.isdigit() and len(code) in (8, 12, 13) and _gtin_check_ok(code):
+        return {8: "EAN8", 12: "UPCA", 13: "EAN13"}[len(code)]
+    if code.isascii() and code.isprintable() and len(code) <= MAX_LINEAR_LENGTH:
+        return "CODE128"
+    return "QRCODE"
+
+
+def symbologies_for(barcodes):
+    """ZBar symbols able to produce any of `barcodes`, most specific first.
+
+    A catalog of check-digit-valid GTINs scans for exactly those
+    symbologies. Other codes may also be printed as QR labels, so QR stays
+    on whenever there is one. Short numeric codes such as "0000" could be
+    printed in any symbology, so they (and an empty catalog) bring back
+    every DEFAULT_SYMBOLS entry.
+    """
+    names = set()
+    for code in barcodes:
+        if not code:
+            continue
+        name = barcode_symbology(code)
+        names.add(name)
+        if name in ("CODE128", "QRCODE"):
+            names.add("QRCODE")
+            if code.isdigit():
+                names.update(symbol.name for symbol in DEFAULT_SYMBOLS)
+    if not names:
+        return list(DEFAULT_SYMBOLS)
+    return [ZBarSymbol[name] for name in SYMBOLOGY_PREFERENCE if name in names]
+
+
+def _box(size, roi):
+    """Pixel box for a fractional (left, top, right, bottom) region of interest."""
+    width, height = size
+    if not roi:
+        return (0, 0, width, height)
+    left, top, right, bottom = roi
+    return (int(left * width), int(top * height), int(right * width), int(bottom * height))
+
+
+def validate_roi(roi):
+    """Checks a region of interest given as fractions of the frame. Returns it as a tuple or None."""
+    if not roi:
+        return None
+    left, top, right, bottom = (float(v) for v in roi)
+    if not (0.0 <= left < right <= 1.0 and 0.0 <= top < bottom <= 1.0):
+        raise ValueError(f"Region of interest must be fractions 0-1 as (left, top, right, bottom), got {roi!r}")
+    return (left, top, right, bottom)
+
+
+def barcode_region(img):
+    """Bounding box of the densest patch of sharp edges in a grayscale image, or None.
+
+    Cheap enough to run on the downscaled frame: bars give a tight cluster
+    of strong edges, plain backgrounds and soft shadows do not. The image is
+    split into cells; nearby dense cells form regions, and the region with
+    the most edge pixels wins, so shelf edges or text elsewhere in the frame
+    do not widen the box. The box covers at most MAX_REGION_FRACTION of the image.
+    """
+    width, height = img.size
+    if width < 3 or height < 3:
+        return None
+    # The filter leaves the outermost pixels unfiltered, so they are cut off
+    edges = img.filter(ImageFilter.FIND_EDGES).crop((1, 1, width - 1, height - 1))
+    edges = edges.point(lambda v: 255 if v >= EDGE_THRESHOLD else 0)
+    density = edges.filter(ImageFilter.BoxBlur(DENSITY_RADIUS))
+    mask = density.point(lambda v: 255 if v >= DENSITY_THRESHOLD else 0)
+    cols = max(1, edges.width // DENSITY_CELL)
+    rows = max(1, edges.height // DENSITY_CELL)
+    # Per cell: how much of it is dense, which ranks regions and picks where to shrink to
+    density = list(mask.resize((cols, rows), Image.BOX).getdata())
+    dense = {i for i, v in enumerate(density) if v}
+
+    best, best_total, seen = None, 0, set()
+    for start in dense:
+        if start in seen:
+            continue
+        seen.add(start)
+        region, stack = [], [start]
+        while stack:
+            cell = stack.pop()
+            region.append(cell)
+            x, y = cell % cols, cell // cols
+            for nx in range(x - REGION_GAP, x + REGION_GAP + 1):
+                for ny in range(y - REGION_GAP, y + REGION_GAP + 1):
+                    neighbour = ny * cols + nx
+                    if 0 <= nx < cols and 0 <= ny < rows and neighbour in dense and neighbour not in seen:
+                        seen.add(neighbour)
+                        stack.append(neighbour)
+        total = sum(density[cell] for cell in region)
+        if total > best_total:
+            best, best_total = region, total
+    if best is None:
+        return None
+
+    cell_w, cell_h = edges.width / cols, edges.height / rows
+    xs = [cell % cols for cell in best]
+    ys = [cell // cols for cell in best]
+    left, top, right, bottom = min(xs) * cell_w, min(ys) * cell_h, (max(xs) + 1) * cell_w, (max(ys) + 1) * cell_h
+    area = (right - left) * (bottom - top)
+    max_area = MAX_REGION_FRACTION * width * height
+    if area > max_area:
+        # Shrink both sides evenly around the densest cell, staying inside the region
+        peak = max(best, key=lambda cell: density[cell])
+        centre_x, centre_y = (peak % cols + 0.5) * cell_w, (peak // cols + 0.5) * cell_h
+        shrink = (max_area / area) ** 0.5
+        half_w, half_h = (right - left) * shrink / 2, (bottom - top) * shrink / 2
+        centre_x = min(max(centre_x, left + half_w), right - half_w)
+        centre_y = min(max(centre_y, top + half_h), bottom - half_h)
+        left, top, right, bottom = centre_x - half_w, centre_y - half_h, centre_x + half_w, centre_y + half_h
+    return (int(left) + 1, int(top) + 1, int(right) + 1, int(bottom) + 1)
+
+
+def _open(jpeg, grayscale, width=None):
+    img = Image.open(io.BytesIO(jpeg))
+    mode = "L" if grayscale else "RGB"
+    if width and img.width > width:
+        # Lets the JPEG decoder scale by 1/2, 1/4 or 1/8 while decoding
+        img.draft(mode, (width, img.height * width // img.width))
+    elif grayscale:
+        img.draft(mode, img.size)
+    img = img.convert(mode)
+    if width and img.width > width:
+        img = img.resize((width, img.height * width // img.width), Image.BILINEAR)
+    return img
+
+
+def _scan(img, plan, passes):
+    for group in plan:
+        started = time.perf_counter()
+        results = [DecodeResult(obj.type, obj.data.decode('utf-8')) for obj in decode(img, symbols=group)]
+        passes.append(([symbol.name for symbol in group], time.perf_counter() - started))
+        if results:
+            return results
+    return []
+
+
+def decode_frame(jpeg, plan, grayscale=True, downscale_width=DOWNSCALE_WIDTH, roi=None):
+    """Decodes one JPEG frame with the two-pass scheme described on FrameDecoder.
+
+    Holds no state, so it can run in a worker process. `plan` is a list of
+    symbol groups tried in turn. Returns (results, tally); the tally lists
+    each pass as (symbology names, seconds) and says whether the
+    full-resolution retry ran.
+    """
+    tally = {"passes": [], "retried": False}
+    frame = _open(jpeg, grayscale, downscale_width)
+    roi_box = _box(frame.size, roi)
+    small = frame.crop(roi_box) if roi else frame
+    results = _scan(small, plan, tally["passes"])
+    if results or not downscale_width:
+        return results, tally
+
+    region = barcode_region(small if grayscale else small.convert("L"))
+    if region is None:
+        return [], tally
+
+    tally["retried"] = True
+    full = _open(jpeg, grayscale)
+    scale = full.width / frame.width
+    left, top, right, bottom = region
+    margin_x = (right - left) * REGION_MARGIN
+    margin_y = (bottom - top) * REGION_MARGIN
+    box = (
+        max(0, int((roi_box[0] + left - margin_x) * scale)),
+        max(0, int((roi_box[1] + top - margin_y) * scale)),
+        min(full.width, int((roi_box[0] + right + margin_x) * scale)),
+        min(full.height, int((roi_box[1] + bottom + margin_y) * scale)),
+    )
+    return _scan(full.crop(box), plan, tally["passes"]), tally
+
+
+class FrameDecoder:
+    """Decodes camera JPEGs with a cheap first pass and a targeted retry.
+
+    0. A frame that looks the same as the last frame without a barcode (by
+       difference hash) is skipped; on an empty or unchanged scene this
+       saves nearly all decode work. Symbologies are tried in order of
+       past success: once one has read barcodes, each scan tries it alone
+       first and the rest only on a miss.
+    1. The JPEG is decoded straight to grayscale at reduced size (the JPEG
+       decoder skips the colour and resolution work) and cropped to the
+       optional region of interest, then scanned.
+    2. If that finds nothing, the densest edge region of the small image is
+       located and only that patch is scanned again at full resolution,
+       which catches barcodes too small to survive the downscale.
+
+    Steps 1 and 2 run in the calling thread, or in a ProcessDecodePool's
+    worker processes when `pool` is given.
+    """
+
+    def __init__(self, symbols=DEFAULT_SYMBOLS, grayscale=True, downscale_width=DOWNSCALE_WIDTH, roi=None,
+                 dedup_distance=DEDUP_MAX_DISTANCE, pool=None):
+        self.symbols = list(symbols)
+        self.grayscale = grayscale
+        self.downscale_width = downscale_width
+        self.roi = validate_roi(roi)
+        # None turns duplicate-frame skipping off
+        self.dedup_distance = dedup_distance
+        self.pool = pool
+        self._miss_hash = None
+        self._skips_in_row = 0
+        self.frames = 0
+        self.skipped = 0
+        self.first_pass_hits = 0
+        self.retries = 0
+        self.retry_hits = 0
+        # Per symbology name: barcodes read, decode passes it was enabled in, seconds spent in them
+        self.symbol_hits = Counter()
+        self.symbol_passes = Counter()
+        self.symbol_seconds = Counter()
+
+    def set_symbols(self, symbols):
+        """Replaces the enabled symbologies (e.g. after the catalog changed). Hit counts are kept."""
+        self.symbols = list(symbols)
+
+    def _plan(self):
+        """Symbol groups to try in turn: the most successful alone, then the rest."""
+        ranked = sorted(self.symbols, key=lambda symbol: -self.symbol_hits[symbol.name])
+        if len(ranked) > 1 and self.symbol_hits[ranked[0].name]:
+            return [ranked[:1], ranked[1:]]
+        return [ranked]
+
+    def decode(self, jpeg):
+        """Returns a list of DecodeResult for the barcodes in a JPEG frame."""
+        self.frames += 1
+        frame_hash = None
+        if self.dedup_distance is not None:
+            frame_hash = dhash(jpeg)
+            if (self._miss_hash is not None and self._skips_in_row < DEDUP_MAX_SKIPS
+                    and hamming(frame_hash, self._miss_hash) <= self.dedup_distance):
+                self._skips_in_row += 1
+                self.skipped += 1
+                return []
+            self._skips_in_row = 0
+
+        results = self._decode(jpeg)
+        # Remember what an empty scene looks like; a hit means the scene has something in it
+        self._miss_hash = None if results else frame_hash
+        return results
+
+    def _decode(self, jpeg):
+        args = (jpeg, self._plan(), self.grayscale, self.downscale_width, self.roi)
+        if self.pool is None:
+            results, tally = decode_frame(*args)
+        else:
+            results, tally = self.pool.submit(decode_frame, *args).result()
+        for names, seconds in tally["passes"]:
+            for name in names:
+                self.symbol_passes[name] += 1
+                self.symbol_seconds[name] += seconds
+        self.symbol_hits.update(result.symbology for result in results)
+        if tally["retried"]:
+            self.retries += 1
+            self.retry_hits += bool(results)
+        else:
+            self.first_pass_hits += bool(results)
+        return results
+
+    def stats(self):
+        order = [symbol.name for group in self._plan() for symbol in group]
+        decoded = self.frames - self.skipped
+        return {
+            "frames": self.frames,
+            "skipped_duplicates": self.skipped,
+            "skip_ratio": self.skipped / self.frames if self.frames else 0.0,
+            "first_pass_hits": self.first_pass_hits,
+            "retries": self.retries,
+            "retry_hits": self.retry_hits,
+            "symbology_order": order,
+            "pool": self.pool.stats() if self.pool else None,
+            "symbologies": {
+                name: {
+                    "hits": self.symbol_hits[name],
+                    "hit_rate": self.symbol_hits[name] / decoded if decoded else 0.0,
+                    "passes": self.symbol_passes[name],
+                    "mean_pass_ms": (1000 * self.symbol_seconds[name] / self.symbol_passes[name]
+                                     if self.symbol_passes[name] else None),
+                }
+                for name in order
+            },
+        }
+
+
+def decode_jpeg(jpeg, symbols=DEFAULT_SYMBOLS):
+    """Decodes barcodes and QR codes straight from JPEG bytes, full frame, no preprocessing."""
+    img = Image.open(io.BytesIO(jpeg))
+    return [DecodeResult(obj.type, obj.data.decode('utf-8')) for obj in decode(img, symbols=symbols)]
+
+
+class ProcessDecodePool:
+    """Worker processes for decode_frame, so several cameras decode on several cores.
+
+    PIL and pyzbar otherwise share one interpreter with capture, Flask and
+    every other camera. At most `max_pending` frames are queued or decoding
+    at once: submit() waits for a free slot, which holds up only the
+    caller's decode worker, and that worker then skips ahead to the newest
+    frame instead of a backlog of stale ones building up.
+
+    A worker that dies (a crash inside libzbar, the OOM killer) breaks the
+    whole executor; the frames it held fail with BrokenProcessPool and the
+    next submit() starts a fresh set of workers.
+    """
+
+    def __init__(self, workers=None, max_pending=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * PENDING_PER_WORKER
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.submitted = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.restarts = 0
+        self._closed = False
+        self._executor = self._start_executor()
+
+    def _start_executor(self):
+        # Spawned rather than forked: the parent has capture and server threads running
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        # Start the workers now, so the first scan does not pay for interpreter start-up
+        executor.submit(int)
+        return executor
+
+    def _restart(self, broken):
+        """Replaces a broken executor, unless another thread already has."""
+        with self._lock:
+            if self._closed or self._executor is not broken:
+                return
+            print(f"ERROR: A decode worker process died; starting {self.workers} new worker(s)")
+            self._executor = self._start_executor()
+            self.restarts += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, fn, *args):
+        """Runs fn(*args) in a worker. Returns a concurrent.futures.Future."""
+        if not self._slots.acquire(blocking=False):
+            started = time.perf_counter()
+            self._slots.acquire()
+            with self._lock:
+                self.waits += 1
+                self.wait_seconds += time.perf_counter() - started
+        try:
+            executor = self._executor
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                self._restart(executor)
+                future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.pending += 1
+            self.submitted += 1
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _future):
+        with self._lock:
+            self.pending -= 1
+        self._slots.release()
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "submitted": self.submitted,
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "restarts": self.restarts,
+            }
+
+
+def make_decode_pool(backend, workers=None, max_pending=None):
+    """The pool FrameDecoders should use for `backend`: None for "thread", a ProcessDecodePool for "process"."""
+    if backend not in DECODE_BACKENDS:
+        raise ValueError(f"Decode backend must be one of {', '.join(DECODE_BACKENDS)}, got {backend!r}")
+    if backend == "process":
+        return ProcessDecodePool(workers, max_pending)
+    return None
@@ -0,0 +1,139 @@
+import os
+import secrets
+import threading
+import time
+from collections import deque, namedtuple
+
+# --- One captured camera frame (JPEG bytes as received from the ESP32-CAM) ---
+Frame = namedtuple("Frame", ["seq", "jpeg", "captured_at"])
+
+# How many recent frames are kept in memory
+DEFAULT_CAPACITY = 8
+
+# --- HTTP serving (shared by app2.py and barcode.py) ---
+MJPEG_MIMETYPE = "multipart/x-mixed-replace; boundary=frame"
+# Stop proxies from caching or buffering a live stream
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+# Browser cache lifetimes (seconds): the newest frame changes about twice a second,
+# a numbered frame never changes
+LATEST_FRAME_MAX_AGE = 1
+IMMUTABLE_FRAME_MAX_AGE = 60
+
+
+class FrameBuffer:
+    """Ring buffer of the most recent camera frames, held in memory.
+
+    Every frame gets an increasing sequence number. Frames are immutable
+    bytes, so readers can never see one half-written. Optionally the newest
+    frame is also written to disk by a background thread, off the capture
+    path; a slow disk only ever skips frames, it never delays capture.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, persist_path=None):
+        self._frames = deque(maxlen=capacity)
+        self._cond = threading.Condition()
+        self._seq = 0
+        # Sequence numbers restart with the process; the epoch keeps ETags from colliding across restarts
+        self.epoch = secrets.token_hex(4)
+        # Consumers currently inside follow() (e.g. MJPEG preview viewers)
+        self.followers = 0
+        self.persist_path = persist_path
+        self._persist_pending = None
+        self._persist_thread = None
+        if persist_path:
+            self._persist_thread = threading.Thread(target=self._persist_loop, daemon=True)
+            self._persist_thread.start()
+
+    def push(self, jpeg):
+        """Stores a new frame and wakes anyone waiting for it. Returns the Frame."""
+        with self._cond:
+            self._seq += 1
+            frame = Frame(self._seq, jpeg, time.time())
+            self._frames.append(frame)
+            if self.persist_path:
+                self._persist_pending = frame
+            self._cond.notify_all()
+        return frame
+
+    def latest(self):
+        """The newest frame, or None before the first capture."""
+        with self._cond:
+            return self._frames[-1] if self._frames else None
+
+    def get(self, seq):
+        """A specific frame if it is still in the buffer, else None."""
+        with self._cond:
+            for frame in self._frames:
+                if frame.seq == seq:
+                    return frame
+        return None
+
+    def etag(self, frame):
+        """Validator for HTTP caching: changes exactly when the frame does."""
+        return f"{self.epoch}-{frame.seq}"
+
+    def wait_for_newer(self, seq, timeout=None):
+        """Blocks until a frame newer than `seq` exists; returns it, or None on timeout."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > seq, timeout):
+                return None
+            return self._frames[-1]
+
+    def follow(self, idle_timeout=None):
+        """Yields frames as they arrive, starting with the newest one.
+
+        Each step jumps to the newest frame, so a slow consumer skips frames
+        instead of queueing them. Stops after `idle_timeout` seconds with no
+        new frame (e.g. the camera loop stopped).
+        """
+        with self._cond:
+            self.followers += 1
+        try:
+            seq = 0
+            while True:
+                frame = self.wait_for_newer(seq, idle_timeout)
+                if frame is None:
+                    return
+                seq = frame.seq
+                yield frame
+        finally:
+            with self._cond:
+                self.followers -= 1
+
+    def mjpeg_stream(self, idle_timeout=None):
+        """Body of a multipart/x-mixed-replace (MJPEG_MIMETYPE) response showing follow()'s frames."""
+        for frame in self.follow(idle_timeout):
+            yield (b"--frame\r\nContent-Type: image/jpeg\r\n"
+                   b"Content-Length: " + str(len(frame.jpeg)).encode() + b"\r\n\r\n" + frame.jpeg + b"\r\n")
+
+    def frame_response(self, frame, request, immutable=False):
+        """A Flask response serving one frame, answered with a bodiless 304 if the client has it.
+
+        Only the ETag validates: Last-Modified, at one-second resolution,
+        cannot tell apart frames taken 0.1 s apart. `immutable` is for URLs
+        naming a specific frame, which may be cached for longer.
+        """
+        from flask import Response
+        response = Response(frame.jpeg, mimetype="image/jpeg")
+        response.set_etag(self.etag(frame))
+        response.cache_control.private = True
+        if immutable:
+            response.cache_control.max_age = IMMUTABLE_FRAME_MAX_AGE
+        else:
+            response.cache_control.max_age = LATEST_FRAME_MAX_AGE
+            response.cache_control.must_revalidate = True
+        return response.make_conditional(request)
+
+    def _persist_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._persist_pending is not None)
+                frame, self._persist_pending = self._persist_pending, None
+            try:
+                # Write then rename, so anything reading the file never sees a torn image
+                tmp_path = f"{self.persist_path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(frame.jpeg)
+                os.replace(tmp_path, self.persist_path)
+            except OSError as e:
+                print(f"ERROR: Could not save file {self.persist_path}: {e}")
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+
+# --- Defaults (overridable through app config) ---
+DEFAULT_MAXSIZE = 1024
+DEFAULT_TTL_SECONDS = 300.0
+# Not-found results expire sooner, so a product added to the catalog shows up quickly
+DEFAULT_NEGATIVE_TTL_SECONDS = 30.0
+
+
+class LookupCache:
+    """Bounded LRU cache of lookup results with TTLs and catalog-version invalidation.
+
+    A result of None is cached as a negative entry (e.g. an unknown barcode
+    the scanner keeps re-reading). `version` is a callable returning the
+    current catalog version; when it changes, every entry is dropped.
+    """
+
+    def __init__(self, version, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL_SECONDS,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL_SECONDS, clock=time.monotonic):
+        self._version = version
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._seen_version = None
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, compute):
+        """Returns the cached value for key, calling compute() on a miss."""
+        version = self._version()
+        now = self._clock()
+        with self._lock:
+            if version != self._seen_version:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._seen_version = version
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if now < expires_at:
+                    self._entries.move_to_end(key)
+                    if value is None:
+                        self.negative_hits += 1
+                    else:
+                        self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+
+        # Computed outside the lock; two threads missing the same key just both compute it
+        value = compute()
+
+        with self._lock:
+            if version == self._seen_version:
+                ttl = self.negative_ttl if value is None else self.ttl
+                self._entries[key] = (self._clock() + ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Counters for monitoring, as a JSON-friendly dict."""
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "catalog_version": self._seen_version,
+            }
@@ -0,0 +1,106 @@
+import io
+import time
+
+from PIL import Image, ImageChops, ImageStat
+
+# --- Motion-adaptive capture rate (seconds between camera fetches) ---
+# While something moves in front of the camera, and for ACTIVE_HOLD_SECONDS after
+MIN_CAPTURE_DELAY = 0.1
+# An empty, static scene slows down towards this
+MAX_CAPTURE_DELAY = 2.0
+ACTIVE_HOLD_SECONDS = 3.0
+# Each static frame multiplies the delay by this, up to MAX_CAPTURE_DELAY
+IDLE_SLOWDOWN = 1.5
+# Mean absolute difference (0-255) between consecutive thumbnails that counts as motion;
+# sensor noise on a still scene stays well below it
+MOTION_THRESHOLD = 4.0
+# Size of the grayscale thumbnails that are compared
+THUMBNAIL_SIZE = (32, 24)
+# Difference hash: 9x8 thumbnail -> 64 bits
+DHASH_SIZE = 8
+
+
+def thumbnail(jpeg, size=THUMBNAIL_SIZE):
+    """Tiny grayscale copy of a JPEG frame. The JPEG decoder does most of the shrinking (1/8 scale)."""
+    img = Image.open(io.BytesIO(jpeg))
+    img.draft("L", (size[0] * 2, size[1] * 2))
+    return img.convert("L").resize(size, Image.BILINEAR)
+
+
+def dhash(jpeg, size=DHASH_SIZE):
+    """64-bit difference hash of a JPEG frame: one bit per "is this pixel brighter than its right neighbour"."""
+    pixels = list(thumbnail(jpeg, (size + 1, size)).getdata())
+    bits = 0
+    for row in range(size):
+        start = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (pixels[start + col] > pixels[start + col + 1])
+    return bits
+
+
+def hamming(a, b):
+    """Number of differing bits between two hashes."""
+    return bin(a ^ b).count("1")
+
+
+class MotionScheduler:
+    """Picks the delay before the next camera fetch from how much the scene is changing.
+
+    Consecutive frames are compared as tiny grayscale thumbnails. Motion (a
+    product being presented) drops the delay to `min_delay` and holds it
+    there for a few seconds; a static scene lets it grow from `base_delay`
+    to `max_delay`, saving CPU, Wi-Fi and camera load when nobody is there.
+    """
+
+    def __init__(self, base_delay, min_delay=MIN_CAPTURE_DELAY, max_delay=MAX_CAPTURE_DELAY,
+                 threshold=MOTION_THRESHOLD, hold=ACTIVE_HOLD_SECONDS, clock=time.monotonic):
+        self.base_delay = base_delay
+        self.min_delay = min(min_delay, base_delay)
+        self.max_delay = max(max_delay, base_delay)
+        self.threshold = threshold
+        self.hold = hold
+        self._clock = clock
+        self._previous = None
+        self._active_until = 0.0
+        self.delay = base_delay
+        self.motion = 0.0
+        self.frames = 0
+        self.motion_frames = 0
+
+    def reset(self):
+        """A scan just started, so someone is at the kiosk: begin at the fast rate."""
+        self._previous = None
+        self._active_until = self._clock() + self.hold
+        self.delay = self.min_delay
+
+    def next_delay(self, jpeg):
+        """Scores a newly captured frame against the previous one; returns seconds to wait."""
+        self.frames += 1
+        try:
+            thumb = thumbnail(jpeg)
+        except OSError:
+            # Not a decodable JPEG: keep the current pace
+            return self.delay
+
+        now = self._clock()
+        previous, self._previous = self._previous, thumb
+        self.motion = ImageStat.Stat(ImageChops.difference(thumb, previous)).mean[0] if previous else 0.0
+        if self.motion >= self.threshold:
+            self.motion_frames += 1
+            self._active_until = now + self.hold
+
+        if now < self._active_until:
+            self.delay = self.min_delay
+        elif self.delay < self.base_delay:
+            self.delay = self.base_delay
+        else:
+            self.delay = min(self.max_delay, self.delay * IDLE_SLOWDOWN)
+        return self.delay
+
+    def stats(self):
+        return {
+            "delay": self.delay,
+            "motion": round(self.motion, 2),
+            "frames": self.frames,
+            "motion_frames": self.motion_frames,
+        }
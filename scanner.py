@@ -0,0 +1,438 @@
+import secrets
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+from camera import CameraClient
+from decoding import FrameDecoder, decode_jpeg
+from frames import FrameBuffer
+
+# Pause between camera fetches, and the longer pause after a failed fetch
+DEFAULT_CAPTURE_DELAY = 0.5
+# How long the decode worker waits for a frame before re-checking for stop
+DECODE_POLL_SECONDS = 0.5
+# Finished scan jobs kept around for their result pages; the oldest are forgotten first
+MAX_FINISHED_JOBS = 256
+# A scan job that has not decoded after SCAN_JOB_TIMEOUT seconds expires; one nobody has
+# polled or watched for SCAN_JOB_IDLE_SECONDS (the customer walked away) is abandoned
+SCAN_JOB_TIMEOUT = 60.0
+SCAN_JOB_IDLE_SECONDS = 20.0
+# How often running jobs are checked against those limits
+REAP_INTERVAL = 1.0
+
+
+class ScanPipeline:
+    """Capture and decode stages running concurrently, joined by the newest frame.
+
+    The capture worker fetches frames into a FrameBuffer while the decode
+    worker decodes whatever frame is newest. The handoff holds one frame:
+    when decoding falls behind, stale frames are skipped rather than queued,
+    so a decode always works on the latest picture.
+
+    `fetch()` returns JPEG bytes or raises; `retry_delay()`, if given, says
+    how long to wait after a failed fetch. With a `scheduler` (a
+    MotionScheduler) the pause after each frame adapts to scene motion
+    instead of being a fixed `capture_delay`. `on_result(frame, results)` is
+    called for each frame with at least one barcode; returning True ends
+    the scan. A stopped pipeline can be resumed for the next scan; its
+    workers are reused, so a camera never has two of either.
+    """
+
+    def __init__(self, fetch, frame_buffer, on_result, capture_delay=DEFAULT_CAPTURE_DELAY,
+                 decode=decode_jpeg, retry_delay=None, scheduler=None):
+        self.fetch = fetch
+        self.scheduler = scheduler
+        self.retry_delay = retry_delay or (lambda: self.capture_delay * 2)
+        self.frame_buffer = frame_buffer
+        self.on_result = on_result
+        self.capture_delay = capture_delay
+        self.decode = decode
+        self._stop = threading.Event()
+        # Guards the decision of a worker to exit against resume() clearing the stop flag
+        self._state_lock = threading.Lock()
+        # Worker name -> thread, for workers that have not exited
+        self._threads = {}
+        # Bumped by every start()/resume(), so a result from an earlier scan cannot stop a later one
+        self._generation = 0
+        self.started_at = None
+        self.first_decode_seconds = None
+        self.frames_captured = 0
+        self.frames_decoded = 0
+        self.frames_skipped = 0
+        self.capture_errors = 0
+
+    @property
+    def running(self):
+        return any(t.is_alive() for t in list(self._threads.values())) and not self._stop.is_set()
+
+    def start(self):
+        """Starts both workers."""
+        with self._state_lock:
+            self._begin_scan()
+        return self
+
+    def resume(self):
+        """Starts another scan after stop(): running workers carry on, exited ones are started again."""
+        with self._state_lock:
+            self._stop.clear()
+            self._begin_scan()
+        return self
+
+    def _begin_scan(self):
+        self._generation += 1
+        self.started_at = time.monotonic()
+        self.first_decode_seconds = None
+        if self.scheduler is not None:
+            self.scheduler.reset()
+        if "scan-capture" not in self._threads:
+            self._spawn("scan-capture", self._capture_loop)
+        if "scan-decode" not in self._threads:
+            latest = self.frame_buffer.latest()
+            self._spawn("scan-decode", self._decode_loop, latest.seq if latest else 0)
+
+    def _spawn(self, name, target, *args):
+        thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+        self._threads[name] = thread
+        thread.start()
+
+    def _exiting(self):
+        """Loop check for a worker: True once it should stop, after which it must return."""
+        if not self._stop.is_set():
+            return False
+        with self._state_lock:
+            # resume() may have cleared the flag since it was read
+            if not self._stop.is_set():
+                return False
+            del self._threads[threading.current_thread().name]
+            return True
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        for thread in list(self._threads.values()):
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def _capture_loop(self):
+        print("\n--- Starting capture worker ---")
+        while not self._exiting():
+            try:
+                jpeg = self.fetch()
+            except Exception as e:
+                self.capture_errors += 1
+                print(f"ERROR: Could not fetch image from ESP32: {e}")
+                self._stop.wait(self.retry_delay())
+                continue
+
+            self.frame_buffer.push(jpeg)
+            self.frames_captured += 1
+            self._stop.wait(self.scheduler.next_delay(jpeg) if self.scheduler else self.capture_delay)
+        print("--- Capture worker stopped. ---")
+
+    def _decode_loop(self, seq):
+        while not self._exiting():
+            frame = self.frame_buffer.wait_for_newer(seq, timeout=DECODE_POLL_SECONDS)
+            if frame is None:
+                continue
+            # Frames that arrived while the previous decode ran are dropped, not queued
+            self.frames_skipped += frame.seq - seq - 1
+            seq = frame.seq
+            generation = self._generation
+
+            try:
+                results = self.decode(frame.jpeg)
+            except Exception as e:
+                print(f"FATAL DECODE ERROR: {e}")
+                continue
+            self.frames_decoded += 1
+
+            if results:
+                if self.first_decode_seconds is None:
+                    self.first_decode_seconds = time.monotonic() - self.started_at
+                    print(f"--- Time to first decode: {self.first_decode_seconds:.3f}s "
+                          f"(frame {frame.seq}, {self.frames_decoded} decoded, {self.frames_skipped} skipped) ---")
+                if self.on_result(frame, results):
+                    with self._state_lock:
+                        # A resume() since this frame was taken started a new scan that must keep running
+                        if self._generation == generation:
+                            self._stop.set()
+
+    def stats(self):
+        """Counters for this scan, as a JSON-friendly dict."""
+        return {
+            "running": self.running,
+            "frames_captured": self.frames_captured,
+            "frames_decoded": self.frames_decoded,
+            "frames_skipped": self.frames_skipped,
+            "capture_errors": self.capture_errors,
+            "time_to_first_decode": self.first_decode_seconds,
+        }
+
+
+# -----------------------------------------------------
+# SCAN JOBS
+# -----------------------------------------------------
+
+class CameraFeed:
+    """One camera's capture and decode pipeline, shared by every scan job on that camera.
+
+    The pipeline starts when the first job needs it and stops itself once
+    no job on the camera is still waiting for a barcode.
+    """
+
+    def __init__(self, name, url, decoder=None, frame_buffer=None, capture_delay=DEFAULT_CAPTURE_DELAY,
+                 scheduler=None):
+        self.name = name
+        self.url = url
+        self.client = CameraClient(url)
+        self.decoder = decoder or FrameDecoder()
+        self.frames = frame_buffer or FrameBuffer()
+        self.capture_delay = capture_delay
+        self.scheduler = scheduler
+        self._lock = threading.Lock()
+        self._pipeline = None
+
+    def ensure_running(self, on_result):
+        """Starts the pipeline, or resumes it if it was stopped (its workers may still be finishing a frame)."""
+        with self._lock:
+            if self._pipeline is None:
+                self._pipeline = ScanPipeline(self.client.fetch, self.frames, on_result,
+                                              capture_delay=self.capture_delay, decode=self.decoder.decode,
+                                              retry_delay=self.client.backoff, scheduler=self.scheduler).start()
+            elif not self._pipeline.running:
+                self._pipeline.on_result = on_result
+                self._pipeline.resume()
+            return self._pipeline
+
+    def stop(self):
+        with self._lock:
+            if self._pipeline is not None:
+                self._pipeline.stop()
+
+    @property
+    def running(self):
+        pipeline = self._pipeline
+        return pipeline is not None and pipeline.running
+
+    def stats(self):
+        pipeline = self._pipeline
+        return {
+            "camera": self.client.stats(),
+            "decoder": self.decoder.stats(),
+            "pipeline": pipeline.stats() if pipeline else None,
+            "scheduler": self.scheduler.stats() if self.scheduler else None,
+            "preview_viewers": self.frames.followers,
+        }
+
+
+class ScanJob:
+    """One customer's scan: which camera it watches, its state and its result slot.
+
+    A job starts "scanning" and ends exactly once: "decoded" with a result,
+    or "expired", "cancelled" or "abandoned" without one.
+    """
+
+    def __init__(self, job_id, camera, timeout=None):
+        self.id = job_id
+        self.camera = camera
+        self.created_at = time.time()
+        self.deadline = self.created_at + timeout if timeout else None
+        self.last_seen = self.created_at
+        self.state = "scanning"
+        self.symbology = None
+        self.result = None
+        self.finished_at = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._watchers = 0
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def finish(self, symbology, data):
+        """Ends the job with a decoded barcode. Returns False if it had already ended."""
+        return self.end("decoded", symbology, data)
+
+    def end(self, state, symbology=None, data=None):
+        """Ends the job in `state`. Returns False if it had already ended."""
+        with self._lock:
+            if self.done:
+                return False
+            self.symbology = symbology
+            self.result = data
+            self.finished_at = time.time()
+            self.state = state
+            self._done.set()
+        return True
+
+    def wait(self, timeout=None):
+        """Blocks until the job has ended. Returns True if it has."""
+        return self._done.wait(timeout)
+
+    def touch(self):
+        """A client just asked about this job."""
+        self.last_seen = time.time()
+
+    @contextmanager
+    def watch(self):
+        """Marks the job as watched (e.g. by an open event stream) for the duration."""
+        with self._lock:
+            self._watchers += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._watchers -= 1
+            self.touch()
+
+    def idle_seconds(self, now=None):
+        """Seconds since a client last polled the job; 0 while one is watching it."""
+        if self._watchers:
+            return 0.0
+        return (now or time.time()) - self.last_seen
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "camera": self.camera,
+            "state": self.state,
+            "symbology": self.symbology,
+            "result": self.result,
+            "created_at": self.created_at,
+            "deadline": self.deadline,
+            "finished_at": self.finished_at,
+            "time_to_decode": self.finished_at - self.created_at if self.state == "decoded" else None,
+        }
+
+
+class ScanJobRegistry:
+    """Scan jobs by id, each with its own result, over shared per-camera feeds.
+
+    A decoded frame goes to every job on that camera that was waiting when
+    the frame was captured, so concurrent customers never receive each
+    other's earlier reads and never block one another. While any job is
+    scanning, a reaper expires jobs past their deadline and abandons the
+    ones no client is following; a camera's feed stops as soon as none of
+    its jobs are left scanning.
+    """
+
+    def __init__(self, feeds, job_timeout=SCAN_JOB_TIMEOUT, idle_timeout=SCAN_JOB_IDLE_SECONDS):
+        self.feeds = OrderedDict((feed.name, feed) for feed in feeds)
+        if not self.feeds:
+            raise ValueError("At least one camera feed is required")
+        self.job_timeout = job_timeout
+        self.idle_timeout = idle_timeout
+        # Held while jobs are added and while a feed decides to stop, so a new
+        # job can never attach to a feed that is about to shut down
+        self._lock = threading.RLock()
+        self._jobs = OrderedDict()
+        self._reaper = None
+
+    @property
+    def default_camera(self):
+        return next(iter(self.feeds))
+
+    def add(self, job):
+        """Registers a job without starting its camera."""
+        with self._lock:
+            self._jobs[job.id] = job
+            finished = [job_id for job_id, j in self._jobs.items() if j.done]
+            for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                del self._jobs[job_id]
+        return job
+
+    def start(self, camera=None):
+        """Creates a scan job on `camera` (default: the first) and makes sure its feed runs.
+
+        Raises KeyError for an unknown camera.
+        """
+        camera = camera or self.default_camera
+        feed = self.feeds[camera]
+        with self._lock:
+            job = self.add(ScanJob(secrets.token_urlsafe(8), camera, timeout=self.job_timeout))
+            feed.ensure_running(lambda frame, results: self._dispatch(camera, frame, results))
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap_loop, name="scan-job-reaper", daemon=True)
+                self._reaper.start()
+        return job
+
+    def get(self, job_id):
+        """The job with this id, or None. Counts as the job's client polling it."""
+        if not job_id:
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            job.touch()
+        return job
+
+    def cancel(self, job_id):
+        """Ends a scanning job as "cancelled". Returns the job, or None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.end("cancelled"):
+                print(f"--- Scan job {job.id} cancelled (camera {job.camera}) ---")
+                self._release(job.camera)
+        return job
+
+    def _release(self, camera):
+        """Stops `camera`'s feed if none of its jobs is still scanning. Returns True if it stopped."""
+        if any(job.camera == camera and not job.done for job in self._jobs.values()):
+            return False
+        self.feeds[camera].stop()
+        return True
+
+    def reap(self):
+        """Expires jobs past their deadline and abandons idle ones. Returns how many ended."""
+        now = time.time()
+        ended = 0
+        with self._lock:
+            for job in [job for job in self._jobs.values() if not job.done]:
+                if job.deadline is not None and now >= job.deadline:
+                    state = "expired"
+                elif self.idle_timeout and job.idle_seconds(now) >= self.idle_timeout:
+                    state = "abandoned"
+                else:
+                    continue
+                if job.end(state):
+                    ended += 1
+                    print(f"--- Scan job {job.id} {state} without a barcode (camera {job.camera}) ---")
+                    self._release(job.camera)
+        return ended
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(REAP_INTERVAL)
+            self.reap()
+            with self._lock:
+                # Exits with the last scanning job; start() launches a new reaper for the next one
+                if all(job.done for job in self._jobs.values()):
+                    self._reaper = None
+                    return
+
+    def _dispatch(self, camera, frame, results):
+        """Hands a decode to the waiting jobs on `camera`. Returns True (stop the feed) when none are left."""
+        code_type, data = results[0]
+        with self._lock:
+            waiting = [job for job in self._jobs.values() if job.camera == camera and not job.done]
+            for job in waiting:
+                # A frame captured before the job started belongs to whoever was scanning then
+                if frame.captured_at >= job.created_at:
+                    job.finish(code_type, data)
+                    print(f"--- DECODED {code_type}: {data} (camera {camera}, frame {frame.seq}, job {job.id}) ---")
+            return self._release(camera)
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "jobs": {
+                "scanning": sum(1 for job in jobs if not job.done),
+                "finished": sum(1 for job in jobs if job.done),
+                "states": dict(Counter(job.state for job in jobs)),
+            },
+            "cameras": {name: feed.stats() for name, feed in self.feeds.items()},
+        }
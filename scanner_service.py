@@ -0,0 +1,373 @@
+"""Multi-camera barcode scanner service.
+
+Fetches from every configured ESP32-CAM concurrently on one asyncio event
+loop and decodes frames on a shared thread pool. Cameras, decode settings
+and where results go are read from a JSON config file:
+
+    {
+      "catalog": "database/products.csv",
+      "decode_backend": "thread",
+      "decode_workers": 2,
+      "scan_delay_seconds": 0.5,
+      "decoder": {"grayscale": true, "downscale_width": 400, "roi": null, "dedup_distance": 1},
+      "cameras": [
+        {"name": "aisle-1", "url": "http://192.168.1.132/"},
+        {"name": "aisle-2", "url": "http://10.233.119.250/", "roi": [0.2, 0.1, 0.8, 0.9],
+         "post_url": "http://127.0.0.1:8000/scans"}
+      ]
+    }
+
+Only "cameras" (each with "name" and "url") is required; a camera's own
+"scan_delay_seconds", "repeat_seconds", "roi" or "decoder" settings
+override the top-level ones. Capture is motion-adaptive unless "adaptive"
+is false: it speeds up to "min_delay_seconds" while something moves in
+front of the camera and slows to "max_delay_seconds" when the scene is
+still. Each result is printed and, if the camera
+has a "post_url", POSTed there as JSON.
+
+Frames decode on "decode_workers" threads, or with "decode_backend":
+"process" in that many worker processes, which lets several cameras use
+several cores; "decode_max_pending" caps the frames queued for them.
+
+    python scanner_service.py cameras.json
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from camera import AsyncCameraClient, CameraError
+from decoding import (DECODE_BACKENDS, DEDUP_MAX_DISTANCE, DOWNSCALE_WIDTH, FrameDecoder, make_decode_pool,
+                      symbologies_for, validate_roi)
+from frames import FrameBuffer
+from motion import MAX_CAPTURE_DELAY, MIN_CAPTURE_DELAY, MotionScheduler
+
+# --- Defaults for keys missing from the config file ---
+DEFAULT_DECODE_BACKEND = "thread"
+DEFAULT_DECODE_WORKERS = 2
+DEFAULT_SCAN_DELAY = 0.5
+# A camera reporting the same barcode again within this window is not re-announced
+DEFAULT_REPEAT_SECONDS = 3.0
+
+
+class ConfigError(ValueError):
+    """The scanner config file is missing required keys or has invalid values."""
+
+
+def load_config(path):
+    """Reads and validates a scanner config file. Returns the config dict."""
+    with open(path, encoding="utf-8") as f:
+        try:
+            config = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ConfigError(f"{path}: {e}") from None
+    return validate_config(config)
+
+
+# Numeric settings, allowed at the top level and per camera: (key, integer, smallest value)
+NUMERIC_SETTINGS = (
+    ("scan_delay_seconds", False, 0.0),
+    ("min_delay_seconds", False, 0.0),
+    ("max_delay_seconds", False, 0.0),
+    ("repeat_seconds", False, 0.0),
+)
+DECODER_SETTINGS = (
+    ("downscale_width", True, 0),
+    ("dedup_distance", True, 0),
+)
+
+
+def _check_number(settings, key, integer, minimum, where):
+    value = settings.get(key)
+    if value is None:
+        return
+    # bool is an int subclass, but "true" is never a sensible delay or count
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or (integer and value != int(value)):
+        kind = "a whole number" if integer else "a number"
+        raise ConfigError(f"{where}'{key}' must be {kind}, got {value!r}")
+    if value < minimum:
+        raise ConfigError(f"{where}'{key}' must be at least {minimum}, got {value!r}")
+
+
+def _check_camera_settings(settings, where):
+    for key, integer, minimum in NUMERIC_SETTINGS:
+        _check_number(settings, key, integer, minimum, where)
+    decoder = settings.get("decoder", {})
+    if not isinstance(decoder, dict):
+        raise ConfigError(f"{where}'decoder' must be an object")
+    for key, integer, minimum in DECODER_SETTINGS:
+        _check_number(decoder, key, integer, minimum, f"{where}decoder ")
+    for roi in (decoder.get("roi"), settings.get("roi")):
+        try:
+            validate_roi(roi)
+        except (TypeError, ValueError) as e:
+            raise ConfigError(f"{where}'roi': {e}") from None
+
+
+def validate_config(config):
+    if not isinstance(config, dict):
+        raise ConfigError("Config must be a JSON object")
+    cameras = config.get("cameras")
+    if not cameras or not isinstance(cameras, list):
+        raise ConfigError("Config needs a non-empty 'cameras' list")
+    _check_camera_settings(config, "")
+    names = set()
+    for i, cam in enumerate(cameras):
+        if not isinstance(cam, dict) or not cam.get("name") or not cam.get("url"):
+            raise ConfigError(f"Camera #{i + 1} needs both 'name' and 'url'")
+        if cam["name"] in names:
+            raise ConfigError(f"Duplicate camera name '{cam['name']}'")
+        names.add(cam["name"])
+        _check_camera_settings(cam, f"Camera '{cam['name']}': ")
+    _check_number(config, "decode_workers", True, 1, "")
+    _check_number(config, "decode_max_pending", True, 1, "")
+    if config.get("decode_backend", DEFAULT_DECODE_BACKEND) not in DECODE_BACKENDS:
+        raise ConfigError(f"'decode_backend' must be one of {', '.join(DECODE_BACKENDS)}")
+    return config
+
+
+class CameraScanner:
+    """Per-camera state: connection, recent frames, decoder and the last result."""
+
+    def __init__(self, cam_config, defaults, decode_pool=None):
+        self.name = cam_config["name"]
+        self.url = cam_config["url"]
+        self.post_url = cam_config.get("post_url")
+        self.scan_delay = float(cam_config.get("scan_delay_seconds", defaults.get("scan_delay_seconds", DEFAULT_SCAN_DELAY)))
+        self.scheduler = None
+        if cam_config.get("adaptive", defaults.get("adaptive", True)):
+            self.scheduler = MotionScheduler(
+                self.scan_delay,
+                min_delay=float(cam_config.get("min_delay_seconds", defaults.get("min_delay_seconds", MIN_CAPTURE_DELAY))),
+                max_delay=float(cam_config.get("max_delay_seconds", defaults.get("max_delay_seconds", MAX_CAPTURE_DELAY))),
+            )
+        self.repeat_seconds = float(cam_config.get("repeat_seconds", defaults.get("repeat_seconds", DEFAULT_REPEAT_SECONDS)))
+        decoder_config = dict(defaults.get("decoder", {}))
+        decoder_config.update(cam_config.get("decoder", {}))
+        if "roi" in cam_config:
+            decoder_config["roi"] = cam_config["roi"]
+        self.client = AsyncCameraClient(self.url)
+        self.frames = FrameBuffer(persist_path=cam_config.get("persist_path"))
+        self.decoder = FrameDecoder(
+            grayscale=decoder_config.get("grayscale", True),
+            downscale_width=decoder_config.get("downscale_width", DOWNSCALE_WIDTH),
+            roi=decoder_config.get("roi"),
+            dedup_distance=decoder_config.get("dedup_distance", DEDUP_MAX_DISTANCE),
+            pool=decode_pool,
+        )
+        self.new_frame = None  # asyncio.Event, created on the service's loop
+        self.last_result = None
+        self.last_result_at = 0.0
+        self.frames_decoded = 0
+        self.frames_skipped = 0
+        self.capture_errors = 0
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "camera": self.client.stats(),
+            "decoder": self.decoder.stats(),
+            "scheduler": self.scheduler.stats() if self.scheduler else None,
+            "frames_decoded": self.frames_decoded,
+            "frames_skipped": self.frames_skipped,
+            "capture_errors": self.capture_errors,
+            "last_result": self.last_result,
+        }
+
+
+class ScannerService:
+    """Scans N cameras concurrently: async fetching on one loop, decoding on a shared pool.
+
+    Each camera has a capture task and a decode task joined by its frame
+    buffer, so a camera never has more than one frame waiting to decode;
+    stale frames are skipped. `subscribe(callback)` adds an in-process
+    result handler, called as callback(camera_name, results) on the loop.
+    """
+
+    def __init__(self, config):
+        config = validate_config(config)
+        self.config = config
+        workers = int(config.get("decode_workers", DEFAULT_DECODE_WORKERS))
+        self.process_pool = make_decode_pool(config.get("decode_backend", DEFAULT_DECODE_BACKEND), workers,
+                                             config.get("decode_max_pending"))
+        self.cameras = {cam["name"]: CameraScanner(cam, config, self.process_pool) for cam in config["cameras"]}
+        # With worker processes these threads only wait on them, one per camera
+        self.decode_pool = ThreadPoolExecutor(
+            max_workers=len(self.cameras) if self.process_pool else workers,
+            thread_name_prefix="decode",
+        )
+        self._subscribers = []
+        self._loop = None
+        self._stopping = None
+        self._thread = None
+        if config.get("catalog"):
+            self.use_catalog(config["catalog"])
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(load_config(path))
+
+    def use_catalog(self, catalog_file):
+        """Limits every camera's decoder to the symbologies a catalog's barcodes can be printed in."""
+        from catalog import ProductCatalog
+        symbols = symbologies_for(ProductCatalog(catalog_file).barcodes())
+        for camera in self.cameras.values():
+            camera.decoder.set_symbols(symbols)
+        print(f"--- Scanning for {', '.join(symbol.name for symbol in symbols)} ---")
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    # -----------------------------------------------------
+    # PER-CAMERA TASKS
+    # -----------------------------------------------------
+
+    async def _capture(self, camera):
+        try:
+            while not self._stopping.is_set():
+                try:
+                    jpeg = await camera.client.fetch()
+                except CameraError as e:
+                    camera.capture_errors += 1
+                    print(f"ERROR: Could not fetch image from {camera.name} ({camera.url}): {e}")
+                    await self._sleep(camera.client.backoff())
+                    continue
+                camera.frames.push(jpeg)
+                camera.new_frame.set()
+                await self._sleep(camera.scheduler.next_delay(jpeg) if camera.scheduler else camera.scan_delay)
+        finally:
+            await camera.client.close()
+
+    async def _decode(self, camera):
+        loop = asyncio.get_running_loop()
+        seq = 0
+        while not self._stopping.is_set():
+            await camera.new_frame.wait()
+            camera.new_frame.clear()
+            frame = camera.frames.latest()
+            if frame is None or frame.seq <= seq:
+                continue
+            # Frames that arrived while the previous decode ran are dropped, not queued
+            if seq:
+                camera.frames_skipped += frame.seq - seq - 1
+            seq = frame.seq
+            try:
+                results = await loop.run_in_executor(self.decode_pool, camera.decoder.decode, frame.jpeg)
+            except Exception as e:
+                print(f"FATAL DECODE ERROR ({camera.name}): {e}")
+                continue
+            camera.frames_decoded += 1
+            if results:
+                self._route(camera, frame, results)
+
+    def _route(self, camera, frame, results):
+        now = time.monotonic()
+        data = [result.data for result in results]
+        if data == camera.last_result and now - camera.last_result_at < camera.repeat_seconds:
+            camera.last_result_at = now
+            return
+        camera.last_result, camera.last_result_at = data, now
+
+        for code_type, value in results:
+            print(f"--- DECODED {code_type}: {value} ({camera.name}, frame {frame.seq}) ---")
+        for callback in self._subscribers:
+            try:
+                callback(camera.name, results)
+            except Exception as e:
+                print(f"ERROR: Result handler failed for {camera.name}: {e}")
+        if camera.post_url:
+            payload = {
+                "camera": camera.name,
+                "frame": frame.seq,
+                "captured_at": frame.captured_at,
+                "results": [{"symbology": t, "data": v} for t, v in results],
+            }
+            # Off the loop: a slow receiver must not stall fetching
+            asyncio.get_running_loop().run_in_executor(None, self._post, camera.post_url, payload)
+
+    @staticmethod
+    def _post(url, payload):
+        try:
+            requests.post(url, json=payload, timeout=5).raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"ERROR: Could not deliver result to {url}: {e}")
+
+    async def _sleep(self, seconds):
+        try:
+            await asyncio.wait_for(self._stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    # -----------------------------------------------------
+    # RUNNING
+    # -----------------------------------------------------
+
+    async def run(self):
+        """Scans every camera until stop() is called."""
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        tasks = []
+        for camera in self.cameras.values():
+            camera.new_frame = asyncio.Event()
+            tasks.append(asyncio.create_task(self._capture(camera), name=f"capture-{camera.name}"))
+            tasks.append(asyncio.create_task(self._decode(camera), name=f"decode-{camera.name}"))
+        print(f"--- Scanner service started: {len(self.cameras)} camera(s) ---")
+        await self._stopping.wait()
+        # Decode tasks may be parked waiting for a frame that will never come
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        print("--- Scanner service stopped. ---")
+
+    def start(self):
+        """Runs the service on its own event loop in a daemon thread (e.g. inside a Flask app)."""
+        started = threading.Event()
+
+        def main():
+            async def run_and_signal():
+                task = asyncio.create_task(self.run())
+                await asyncio.sleep(0)
+                started.set()
+                await task
+            asyncio.run(run_and_signal())
+
+        self._thread = threading.Thread(target=main, name="scanner-service", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None and self._stopping is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.decode_pool.shutdown(wait=False)
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+
+    def stats(self):
+        return {name: camera.stats() for name, camera in self.cameras.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan barcodes from several ESP32-CAMs at once.")
+    parser.add_argument("config", help="JSON scanner config file")
+    args = parser.parse_args()
+    try:
+        service = ScannerService.from_file(args.config)
+    except (OSError, ConfigError) as e:
+        print(f"ERROR: {e}")
+        raise SystemExit(1)
+    try:
+        asyncio.run(service.run())
+    except KeyboardInterrupt:
+        print("--- Scanner service interrupted. ---")
+
+
+if __name__ == '__main__':
+    main()
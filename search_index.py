@@ -0,0 +1,277 @@
+import heapq
+import itertools
+import re
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+
+# --- Tuning ---
+# Minimum trigram similarity (Dice coefficient) for a misspelled word to count as a match
+MIN_FUZZY_SCORE = 0.4
+# A word within one typo of another shares all but 3 of its trigrams, so fuzzy
+# candidates only need to be gathered from its rarest (3 + 1) trigrams.
+CANDIDATE_TRIGRAMS = 4
+# How many catalog words each query word may expand to
+MAX_WORD_MATCHES = 4
+# Cap on how many catalog words a short prefix is compared against
+MAX_PREFIX_WORDS = 64
+# Only the first few query words take part in matching
+MAX_QUERY_WORDS = 4
+# Word combinations tried per query, best first (4 words x 4 matches would be 256)
+MAX_COMBINATIONS = 16
+# Posting entries a query may step through while intersecting; words that share no
+# product within this budget are treated as not occurring together
+MAX_INTERSECT_STEPS = 4000
+# A word in at least 1/DENSE_FRACTION of the products is stored as a bitset instead of a
+# posting list: no larger (one bit per product vs 4 bytes per entry) and intersected in C
+DENSE_FRACTION = 32
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+
+def normalize(text):
+    """Lowercases a name and turns punctuation into single spaces ("Semi-Skimmed" -> "semi skimmed")."""
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+
+def trigrams(word):
+    """Returns the set of padded character trigrams for an already normalized word."""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def name_hash(norm):
+    """Stable 32-bit hash of a normalized name (the same in every process, unlike hash())."""
+    return zlib.crc32(norm.encode("utf-8"))
+
+
+def _indexed(word):
+    # Bare numbers ("5", "#56986") say nothing about the product and would swamp the vocabulary
+    return not word.isdigit()
+
+
+class NameSearchIndex:
+    """Precomputed typo-tolerant search over product names.
+
+    Query words are matched against the catalog's vocabulary (exactly, as a
+    prefix via a sorted word list, or by trigram similarity for typos like
+    "bred"), then the products holding those words are found by intersecting
+    per-word postings. Products are numbered shortest-name-first, so the
+    postings are walked in rank order and each combination stops as soon
+    as `limit` products are found, without scoring every product. Rare
+    words have sorted posting lists; common words have bitsets, which are
+    ANDed as integers when a combination has only common words.
+
+    All per-product data is held in flat arrays (see to_arrays()), so a
+    compiled catalog can store the index and load it without rebuilding.
+    """
+
+    def __init__(self, names):
+        names = names if isinstance(names, list) else list(names)
+        normalized = [normalize(name) for name in names]
+
+        # Internal ids: rank of each product when ordered by (name length, catalog position)
+        order = sorted(range(len(names)), key=lambda i: (len(normalized[i]), i))
+        word_ranks = defaultdict(list)
+        exact = []
+        for rank, product_id in enumerate(order):
+            norm = normalized[product_id]
+            exact.append((name_hash(norm), rank))
+            for word in set(norm.split()):
+                if _indexed(word):
+                    word_ranks[word].append(rank)
+        words = sorted(word_ranks)
+        offsets = array("I", [0])
+        postings = array("I")
+        slots = array("i")
+        bitsets = bytearray()
+        stride = (len(names) + 7) // 8
+        for word in words:
+            ranks = word_ranks[word]
+            if len(ranks) * DENSE_FRACTION >= len(names):
+                slots.append(len(bitsets) // stride)
+                bitset = bytearray(stride)
+                for rank in ranks:
+                    bitset[rank >> 3] |= 1 << (rank & 7)
+                bitsets += bitset
+            else:
+                slots.append(-1)
+                postings.extend(ranks)
+            offsets.append(len(postings))
+        exact.sort()
+        self._load(
+            names, words, offsets, postings, slots, bytes(bitsets),
+            order=array("I", order),
+            lengths=array("H", (min(len(normalized[i]), 0xFFFF) for i in order)),
+            exact_hashes=array("I", (h for h, _ in exact)),
+            exact_ranks=array("I", (rank for _, rank in exact)),
+        )
+
+    @classmethod
+    def from_arrays(cls, names, words, arrays):
+        """Rebuilds an index from to_arrays() output without re-reading any names.
+
+        `names` only needs len() and indexing; the arrays may be memoryviews.
+        """
+        index = cls.__new__(cls)
+        index._load(names, list(words), **arrays)
+        return index
+
+    def to_arrays(self):
+        """(vocabulary, {name: array}) describing the whole index, for storing in a compiled catalog."""
+        return self._words, {
+            "offsets": self._offsets,
+            "postings": self._postings,
+            "slots": self._slots,
+            "bitsets": self._bitsets,
+            "order": self._order,
+            "lengths": self._lengths,
+            "exact_hashes": self._exact_hashes,
+            "exact_ranks": self._exact_ranks,
+        }
+
+    def _load(self, names, words, offsets, postings, slots, bitsets, order, lengths, exact_hashes, exact_ranks):
+        self.names = names
+        self._words = words
+        self._word_index = {word: i for i, word in enumerate(words)}
+        self._offsets = offsets
+        self._postings = postings
+        self._slots = slots
+        self._bitsets = memoryview(bitsets)
+        self._stride = (len(order) + 7) // 8
+        self._order = order
+        self._lengths = lengths
+        self._exact_hashes = exact_hashes
+        self._exact_ranks = exact_ranks
+
+        self._word_grams = {}
+        grams_to_words = defaultdict(list)
+        for word in words:
+            grams = frozenset(trigrams(word))
+            self._word_grams[word] = grams
+            for gram in grams:
+                grams_to_words[gram].append(word)
+        self._gram_words = dict(grams_to_words)
+
+    def __len__(self):
+        return len(self._order)
+
+    def _exact(self, norm):
+        """Rank of the first product whose normalized name is exactly `norm`, or None."""
+        target = name_hash(norm)
+        i = bisect_left(self._exact_hashes, target)
+        while i < len(self._exact_hashes) and self._exact_hashes[i] == target:
+            rank = self._exact_ranks[i]
+            if normalize(self.names[self._order[rank]]) == norm:
+                return rank
+            i += 1
+        return None
+
+    def _match_word(self, query_word):
+        """Returns up to MAX_WORD_MATCHES (similarity, catalog word) pairs, best first."""
+        matches = {}
+        if query_word in self._word_index:
+            matches[query_word] = 1.0
+
+        # Prefix: "skim" -> "skimmed"
+        start = bisect_left(self._words, query_word)
+        for word in self._words[start:start + MAX_PREFIX_WORDS]:
+            if not word.startswith(query_word):
+                break
+            if word not in matches:
+                matches[word] = 0.6 + 0.3 * len(query_word) / len(word)
+
+        # Typos: "bred" -> "bread"
+        query_grams = trigrams(query_word)
+        known = sorted((g for g in query_grams if g in self._gram_words), key=lambda g: len(self._gram_words[g]))
+        candidates = set()
+        for gram in known[:CANDIDATE_TRIGRAMS]:
+            candidates.update(self._gram_words[gram])
+        for word in candidates:
+            grams = self._word_grams[word]
+            dice = 2.0 * len(query_grams & grams) / (len(query_grams) + len(grams))
+            if dice >= MIN_FUZZY_SCORE and dice * 0.9 > matches.get(word, 0.0):
+                matches[word] = dice * 0.9
+
+        ranked = sorted(((sim, word) for word, sim in matches.items()), key=lambda m: (-m[0], m[1]))
+        return ranked[:MAX_WORD_MATCHES]
+
+    def _ranks(self, words, budget):
+        """Yields the ranks of products holding every word, ascending; budget is a one-item step counter."""
+        spans, dense = [], []
+        for word in words:
+            i = self._word_index[word]
+            slot = self._slots[i]
+            if slot < 0:
+                spans.append([self._offsets[i], self._offsets[i + 1]])
+            else:
+                dense.append(self._bitsets[slot * self._stride:(slot + 1) * self._stride])
+
+        if not spans:
+            bits = int.from_bytes(dense[0], "little")
+            for bitset in dense[1:]:
+                bits &= int.from_bytes(bitset, "little")
+            while bits:
+                lowest = bits & -bits
+                yield lowest.bit_length() - 1
+                bits ^= lowest
+            return
+
+        postings = self._postings
+        spans.sort(key=lambda span: span[1] - span[0])
+        pos, end = spans[0]
+        others = spans[1:]
+        while pos < end and budget[0] > 0:
+            budget[0] -= 1
+            rank = postings[pos]
+            if not all(bitset[rank >> 3] >> (rank & 7) & 1 for bitset in dense):
+                pos += 1
+                continue
+            for span in others:
+                j = bisect_left(postings, rank, span[0], span[1])
+                if j == span[1]:
+                    return
+                span[0] = j
+                if postings[j] != rank:
+                    # Leapfrog: the shortest list jumps ahead to the other list's next entry
+                    pos = bisect_left(postings, postings[j], pos + 1, end)
+                    break
+            else:
+                yield rank
+                pos += 1
+
+    def search(self, query, limit=5):
+        """Returns up to `limit` (product_id, score) pairs, best first. Scores are in (0, 1]."""
+        norm = normalize(query or "")
+        if not norm:
+            return []
+
+        results = {}
+        exact = self._exact(norm)
+        if exact is not None:
+            results[exact] = 1.0
+
+        query_words = [word for word in norm.split() if _indexed(word)][:MAX_QUERY_WORDS]
+        per_word = [m for m in (self._match_word(w) for w in query_words) if m]
+        if per_word:
+            # Try word combinations best-first, each walking its postings in rank order
+            combos = heapq.nsmallest(MAX_COMBINATIONS, itertools.product(*per_word),
+                                     key=lambda combo: -sum(sim for sim, _ in combo))
+            budget = [MAX_INTERSECT_STEPS]
+            for combo in combos:
+                if len(results) >= limit or budget[0] <= 0:
+                    break
+                word_score = sum(sim for sim, _ in combo) / len(query_words)
+                found = 0
+                for rank in self._ranks({word for _, word in combo}, budget):
+                    if rank in results:
+                        continue
+                    coverage = min(len(norm) / max(self._lengths[rank], 1), 1.0)
+                    results[rank] = 0.95 * word_score * (0.7 + 0.3 * coverage)
+                    found += 1
+                    if found >= limit:
+                        break
+
+        ranked = sorted(results.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [(self._order[rank], score) for rank, score in ranked]
@@ -0,0 +1,85 @@
+import argparse
+import time
+
+from catalog import CatalogError, load_catalog
+
+# Canonical products.csv column for each accepted spreadsheet header (compared lowercased)
+HEADER_ALIASES = {
+    "name": "Name",
+    "product": "Name",
+    "product name": "Name",
+    "barcode": "Barcode",
+    "ean": "Barcode",
+    "x": "X",
+    "y": "Y",
+    "z": "Z",
+    "allergy": "Allergy",
+    "allergies": "Allergy",
+    "allergens": "Allergy",
+}
+REQUIRED_COLUMNS = ("Name", "X", "Y", "Z")
+
+
+def _cell_text(cell):
+    """Turns a worksheet cell into the string products.csv would hold."""
+    value = cell.value
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, int):
+        # Barcodes typed as numbers lose their leading zeros; a "0000"-style
+        # number format tells us how many digits the vendor meant.
+        number_format = getattr(cell, "number_format", "") or ""
+        if number_format and set(number_format) == {"0"}:
+            return str(value).zfill(len(number_format))
+        return str(value)
+    return str(value).strip()
+
+
+def read_workbook_rows(xlsx_file, sheet=None):
+    """Streams (row number, row dict) from a products workbook.
+
+    The workbook is opened read-only, so rows are parsed as they are read and
+    memory use does not grow with the sheet. Headers are mapped onto the
+    products.csv column names; blank rows are skipped.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(xlsx_file, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.active
+        rows = worksheet.iter_rows()
+        header = next(rows, None)
+        if header is None:
+            return
+
+        columns = [HEADER_ALIASES.get(_cell_text(cell).lower()) for cell in header]
+        missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+        if missing:
+            raise CatalogError(f"{xlsx_file} is missing column(s): {', '.join(missing)}")
+
+        for row_no, cells in enumerate(rows, start=2):
+            row = {}
+            for column, cell in zip(columns, cells):
+                if column and column not in row:
+                    row[column] = _cell_text(cell)
+            if any(row.values()):
+                yield row_no, row
+    finally:
+        # Read-only workbooks keep the file open until closed
+        workbook.close()
+
+
+# -----------------------------------------------------
+# COMMAND LINE: validate a vendor workbook
+# -----------------------------------------------------
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Validate a products workbook and report what would be imported.")
+    parser.add_argument("workbook", nargs="?", default="database/products.xlsx")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    data = load_catalog(args.workbook)
+    print(f"--- {len(data)} products valid, {data.rejected} rejected "
+          f"({time.perf_counter() - started:.1f}s) ---")